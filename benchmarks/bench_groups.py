@@ -0,0 +1,78 @@
+# telepathy-mixer - an MXit connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Benchmark of moving buddies between groups.
+
+Loads a roster spread over many groups, then moves buddies to other groups
+through MixerListener.buddy_updated. The cost per move should not depend on
+the number of groups.
+
+    PYTHONPATH=.:benchmarks dbus-launch python benchmarks/bench_groups.py [moves] [buddies] [groups]
+"""
+
+import sys
+import time
+import random
+
+from mxit.handles import Status, StatusChangeReason
+
+from fakes import make_roster, make_connection, pump
+
+BUDDIES = 10000
+GROUPS = 200
+MOVES = 20000
+
+
+def main(args):
+    moves = MOVES
+    buddies = BUDDIES
+    groups = GROUPS
+    if args:
+        moves = int(args[0])
+    if len(args) > 1:
+        buddies = int(args[1])
+    if len(args) > 2:
+        groups = int(args[2])
+
+    roster = make_roster(buddies, groups)
+    con, listener = make_connection(roster)
+    listener.status_changed(Status.ACTIVE, StatusChangeReason.REQUESTED)
+    start = time.time()
+    for buddy in roster.all_buddies():
+        listener.buddy_added(buddy)
+    pump()
+    print "%d buddies in %d groups loaded in %.2fs" % \
+            (buddies, groups, time.time() - start)
+
+    group_names = ['group%d' % i for i in xrange(groups)]
+    sample = [(random.choice(roster.all_buddies()),
+            roster.get_group(random.choice(group_names))) for i in xrange(moves)]
+
+    start = time.time()
+    for i, (buddy, group) in enumerate(sample):
+        buddy.group = group
+        listener.buddy_updated(buddy, group=group)
+        if i % 100 == 0:
+            pump()
+    pump()
+    elapsed = time.time() - start
+
+    print "%d group moves in %.2fs: %.1f us/move" % \
+            (moves, elapsed, elapsed * 1e6 / moves)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
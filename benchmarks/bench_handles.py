@@ -0,0 +1,84 @@
+#!/usr/bin/python
+#
+# telepathy-mixer - an MXit connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Microbenchmark for handle lookups.
+
+Measures the cost of MixerHandleFactory lookups of existing contact handles
+for growing roster sizes. The cost per lookup should stay flat.
+
+    PYTHONPATH=. python benchmarks/bench_handles.py
+"""
+
+import sys
+import time
+import random
+import weakref
+
+from mixer.handle import MixerHandleFactory, MixerHandleRegistry
+
+ROSTER_SIZES = [100, 1000, 10000, 50000]
+LOOKUPS = 200000
+
+
+class StubConnection(object):
+    """The parts of MixerConnection used by the handle code."""
+
+    def __init__(self):
+        self._account = 'bench@mxit'
+        self._handles = weakref.WeakValueDictionary()
+        self._handle_registry = MixerHandleRegistry(self._handles)
+        self._next_handle_id = 1
+
+    def get_handle_id(self):
+        id = self._next_handle_id
+        self._next_handle_id += 1
+        return id
+
+
+def run(size, lookups):
+    con = StubConnection()
+    jids = ['buddy%d@mxit' % i for i in xrange(size)]
+    handles = [MixerHandleFactory(con, 'contact', jid) for jid in jids]
+
+    sample = [random.choice(jids) for i in xrange(lookups)]
+    start = time.time()
+    for jid in sample:
+        MixerHandleFactory(con, 'contact', jid)
+    elapsed = time.time() - start
+
+    by_id = [random.choice(handles).id for i in xrange(lookups)]
+    start = time.time()
+    for id in by_id:
+        con._handle_registry.get(1, id)
+    elapsed_id = time.time() - start
+
+    return elapsed * 1e9 / lookups, elapsed_id * 1e9 / lookups
+
+
+def main(args):
+    lookups = LOOKUPS
+    if args:
+        lookups = int(args[0])
+    print "%10s %16s %16s" % ('roster', 'ns/name lookup', 'ns/id lookup')
+    for size in ROSTER_SIZES:
+        by_name, by_id = run(size, lookups)
+        print "%10d %16.0f %16.0f" % (size, by_name, by_id)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
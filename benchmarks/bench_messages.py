@@ -0,0 +1,73 @@
+#!/usr/bin/python
+#
+# telepathy-mixer - an MXit connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Benchmark of incoming messages per second.
+
+Feeds messages from a number of buddies through MixerListener.message_received
+and reports the dispatch rate.
+
+    PYTHONPATH=.:benchmarks dbus-launch python benchmarks/bench_messages.py
+"""
+
+import sys
+import time
+
+from mxit.handles import Status, StatusChangeReason, Message
+
+from fakes import make_roster, make_connection, pump
+
+BUDDIES = 1000
+MESSAGES = 50000
+
+
+def main(args):
+    buddies = BUDDIES
+    messages = MESSAGES
+    if args:
+        messages = int(args[0])
+    if len(args) > 1:
+        buddies = int(args[1])
+
+    roster = make_roster(buddies)
+    con, listener = make_connection(roster)
+    listener.status_changed(Status.ACTIVE, StatusChangeReason.REQUESTED)
+    for buddy in roster.all_buddies():
+        listener.buddy_added(buddy)
+    pump()
+
+    senders = roster.all_buddies()
+    # open the text channels first, so only the dispatch is measured
+    for buddy in senders:
+        listener.message_received(Message(buddy, 'hello'))
+    pump()
+
+    start = time.time()
+    for i in xrange(messages):
+        buddy = senders[i % buddies]
+        listener.message_received(Message(buddy, 'message %d' % i))
+        if i % 100 == 0:
+            pump()
+    pump()
+    elapsed = time.time() - start
+
+    print "%d messages from %d buddies in %.2fs: %.0f messages/s" % \
+            (messages, buddies, elapsed, messages / elapsed)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,211 @@
+# telepathy-mixer - an MXit connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Stand-ins for the PyMXit roster objects used by the benchmarks.
+
+The benchmarks need a session bus (run them under dbus-launch) and PyMXit,
+but never talk to the MXit servers."""
+
+import os
+import tempfile
+
+import dbus
+import dbus.mainloop.glib
+import gobject
+
+from mxit.handles import Presence, Mood, BuddyType, Status
+
+from mixer.connection import MixerConnection
+from mixer.listener import MixerListener
+from mixer.settings import SettingsCache
+
+__all__ = ['FakeGroup', 'FakeBuddy', 'FakeRoster', 'FakeMxit', 'StubManager',
+        'make_connection', 'make_roster', 'pump']
+
+
+class FakeGroup(object):
+    def __init__(self, name, root=False):
+        self.name = name
+        self._root = root
+
+    def is_root(self):
+        return self._root
+
+
+class FakeBuddy(object):
+    def __init__(self, jid, name, group, presence=Presence.AVAILABLE,
+            type=BuddyType.MXIT, subscribed=True):
+        self.jid = jid
+        self.name = name
+        self.group = group
+        self.presence = presence
+        self.mood = Mood.NONE
+        self.type = type
+        self.subscribed = subscribed
+        self.buddies = set()
+
+    def is_room(self):
+        return self.type == BuddyType.ROOM
+
+    def is_subscribed(self):
+        return self.subscribed
+
+    def __repr__(self):
+        return "<FakeBuddy %s>" % self.jid
+
+
+class FakeRoster(object):
+    def __init__(self):
+        self.root_group = FakeGroup('', root=True)
+        self.self_buddy = FakeBuddy('self', 'Myself', self.root_group)
+        self.info_buddy = FakeBuddy('info', 'Info', self.root_group)
+        self.buddies = {}
+        self.rooms = {}
+        self.groups = {}
+
+    def get_group(self, name):
+        if name not in self.groups:
+            self.groups[name] = FakeGroup(name)
+        return self.groups[name]
+
+    def add(self, buddy):
+        if buddy.is_room():
+            self.rooms[buddy.jid] = buddy
+        else:
+            self.buddies[buddy.jid] = buddy
+
+    def remove(self, buddy):
+        self.buddies.pop(buddy.jid, None)
+        self.rooms.pop(buddy.jid, None)
+
+    def get_buddy(self, jid):
+        return self.buddies.get(jid)
+
+    def get_room(self, jid):
+        return self.rooms.get(jid)
+
+    def buddy_or_room(self, jid):
+        if jid == self.info_buddy.jid:
+            return self.info_buddy
+        return self.buddies.get(jid) or self.rooms.get(jid)
+
+    def find_buddy(self, name):
+        for buddy in self.buddies.itervalues():
+            if buddy.name == name:
+                return buddy
+
+    def find_room(self, name):
+        for room in self.rooms.itervalues():
+            if room.name == name:
+                return room
+
+    def all_buddies(self):
+        return self.buddies.values()
+
+    def all_rooms(self):
+        return self.rooms.values()
+
+
+class FakeMxit(object):
+    """Records the calls the connection manager makes to MxitConnection."""
+
+    def __init__(self, roster):
+        self.roster = roster
+        self.status = Status.DISCONNECTED
+        self.listeners = set()
+        self.sent = []
+
+    def message(self, buddy, text):
+        self.sent.append((buddy, text))
+
+    def set_presence(self, presence):
+        self.roster.self_buddy.presence = presence
+
+    def set_mood(self, mood):
+        self.roster.self_buddy.mood = mood
+
+    def update_buddy(self, buddy, **attrs):
+        for key, value in attrs.items():
+            setattr(buddy, key, value)
+
+    def connect(self):
+        self.status = Status.ACTIVE
+
+    def close(self):
+        self.status = Status.DISCONNECTED
+
+
+class StubManager(object):
+    """The parts of MixerConnectionManager a connection calls back into."""
+
+    def __init__(self):
+        self.settings_cache = SettingsCache()
+
+    def disconnected(self, conn):
+        pass
+
+
+def make_roster(buddies, groups=0, rooms=0):
+    roster = FakeRoster()
+    for i in xrange(buddies):
+        if groups:
+            group = roster.get_group('group%d' % (i % groups))
+        else:
+            group = roster.root_group
+        roster.add(FakeBuddy('buddy%d' % i, 'Buddy %d' % i, group))
+    for i in xrange(rooms):
+        roster.add(FakeBuddy('room%d' % i, 'Room %d' % i, roster.root_group,
+                type=BuddyType.ROOM))
+    return roster
+
+
+def write_jad(path):
+    jad = open(path, 'w')
+    jad.write("c: BENCH\n")
+    jad.write("cc: 27\n")
+    jad.write("loc: en\n")
+    jad.write("sl1: socket://127.0.0.1:9119\n")
+    jad.close()
+
+
+def make_connection(roster, account='bench@mxit', manager=None, **parameters):
+    """Create a MixerConnection on the session bus that talks to a FakeMxit.
+
+    Returns (connection, listener)."""
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+
+    handle, path = tempfile.mkstemp(suffix='.jad')
+    os.close(handle)
+    write_jad(path)
+
+    params = {'account': account, 'password': 'secret', 'settings-file': path}
+    params.update(parameters)
+    if manager is None:
+        manager = StubManager()
+    con = MixerConnection(manager, params)
+    os.unlink(path)
+
+    con.mxit = FakeMxit(roster)
+    listener = MixerListener(con)
+    con.mxit.listeners.add(listener)
+    return con, listener
+
+
+def pump():
+    """Run the mainloop until there is nothing left to do."""
+    context = gobject.main_context_default()
+    while context.pending():
+        context.iteration(False)
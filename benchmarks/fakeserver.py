@@ -0,0 +1,116 @@
+# telepathy-mixer - an MXit connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""In-process stand-in for the MXit servers.
+
+FakeMxitServer takes the place of MxitConnection (see
+MixerConnection.mxit_connection_class). It answers Connect with a login and a
+roster push, acknowledges sent messages, and lets a benchmark script inject
+presence changes, messages, room joins and files as if they came from the
+network."""
+
+import gobject
+
+from mxit.handles import Status, StatusChangeReason, Message, FileDescriptor
+
+from fakes import FakeMxit
+
+__all__ = ['FakeMxitServer']
+
+
+class FakeMxitServer(FakeMxit):
+
+    def __init__(self, roster, ack_delay=0, **settings):
+        FakeMxit.__init__(self, roster)
+        self.settings = settings
+        self.ack_delay = ack_delay
+        self.files = []
+        self._file_id = 0
+
+    def factory(cls, roster, ack_delay=0):
+        """Returns a replacement for MxitConnection that creates a server
+        for roster."""
+        def create(**settings):
+            return cls(roster, ack_delay, **settings)
+        return staticmethod(create)
+    factory = classmethod(factory)
+
+    # MxitConnection
+
+    def connect(self):
+        self.status = Status.CONNECTING
+        self._notify('status_changed', Status.CONNECTING, StatusChangeReason.REQUESTED)
+        gobject.idle_add(self._login)
+
+    def close(self):
+        self.status = Status.DISCONNECTED
+        self._notify('status_changed', Status.DISCONNECTED, StatusChangeReason.REQUESTED)
+
+    def message(self, buddy, text):
+        FakeMxit.message(self, buddy, text)
+        message = Message(buddy, text)
+        def ack():
+            self._notify('message_sent', message)
+            return False
+        if self.ack_delay:
+            gobject.timeout_add(self.ack_delay, ack)
+        else:
+            gobject.idle_add(ack)
+
+    def send_file(self, descriptor, buddy, file):
+        size = 0
+        while True:
+            data = file.read(64 * 1024)
+            if not data:
+                break
+            size += len(data)
+        self.files.append((descriptor.name, buddy, size))
+
+    # Scripted events
+
+    def change_presence(self, buddy, presence):
+        buddy.presence = presence
+        self._notify('buddy_updated', buddy, presence=presence)
+
+    def rename(self, buddy, name):
+        buddy.name = name
+        self._notify('buddy_updated', buddy, name=name)
+
+    def deliver_message(self, buddy, text):
+        self._notify('message_received', Message(buddy, text))
+
+    def join_room(self, room, buddies):
+        room.buddies.update(buddies)
+        self._notify('room_buddies_joined', room, buddies)
+
+    def deliver_file(self, name, data, mimetype='application/octet-stream'):
+        self._file_id += 1
+        descriptor = FileDescriptor(self._file_id, name=name, description='',
+                size=len(data), mimetype=mimetype)
+        self._notify('file_received', descriptor, data)
+
+    def _login(self):
+        self.status = Status.ACTIVE
+        self._notify('status_changed', Status.ACTIVE, StatusChangeReason.REQUESTED)
+        for buddy in self.roster.all_buddies():
+            self._notify('buddy_added', buddy)
+        for room in self.roster.all_rooms():
+            self._notify('room_added', room)
+        return False
+
+    def _notify(self, name, *args, **kwargs):
+        for listener in list(self.listeners):
+            getattr(listener, name)(*args, **kwargs)
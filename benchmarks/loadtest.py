@@ -0,0 +1,304 @@
+#!/usr/bin/python
+#
+# telepathy-mixer - an MXit connection manager for Telepathy
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""End-to-end load benchmark.
+
+Drives a MixerConnection, backed by FakeMxitServer, through login with a
+roster of the given size, a presence storm, a message flood, room joins and
+incoming file transfers. For every phase it records the D-Bus signals
+emitted, wall and CPU time and event-to-signal latency percentiles, and
+prints the results as JSON.
+
+    PYTHONPATH=.:benchmarks dbus-launch python benchmarks/loadtest.py \\
+            --buddies 10000 --output results.json
+"""
+
+import os
+import sys
+import time
+import socket
+import errno
+import resource
+import optparse
+import tempfile
+import collections
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import dbus
+import dbus.lowlevel
+import dbus.mainloop.glib
+import gobject
+
+from mxit.handles import Presence
+
+from mixer.connection import MixerConnection
+from mixer.channel.filetransfer import MixerFileChannel, FT_STATE_PENDING
+
+from fakes import StubManager, make_roster, write_jad
+from fakeserver import FakeMxitServer
+
+# Signals that carry several events, and how to count the events in them
+BATCHED_SIGNALS = {
+    'PresenceUpdate': lambda args: len(args[0]),
+    'AliasesChanged': lambda args: len(args[0]),
+    'MembersChanged': lambda args: len(args[1]) + len(args[2]) + len(args[3]) + len(args[4]),
+}
+
+
+class SignalRecorder(object):
+    """Counts the signals sent on a bus connection and matches them to the
+    events injected by the benchmark, first in first out per signal name."""
+
+    def __init__(self, bus):
+        self.counts = collections.defaultdict(int)
+        self.latencies = []
+        self._waiting = collections.defaultdict(collections.deque)
+        self._send_message = bus.send_message
+        bus.send_message = self._record
+
+    def expect(self, member, count=1):
+        now = time.time()
+        waiting = self._waiting[member]
+        for i in xrange(count):
+            waiting.append(now)
+
+    def reset(self):
+        self.counts = collections.defaultdict(int)
+        self.latencies = []
+        self._waiting.clear()
+
+    def _record(self, message):
+        if isinstance(message, dbus.lowlevel.SignalMessage):
+            member = message.get_member()
+            self.counts[member] += 1
+            waiting = self._waiting.get(member)
+            if waiting:
+                now = time.time()
+                events = 1
+                if member in BATCHED_SIGNALS:
+                    events = BATCHED_SIGNALS[member](message.get_args_list())
+                for i in xrange(min(events, len(waiting))):
+                    self.latencies.append(now - waiting.popleft())
+        return self._send_message(message)
+
+
+def settle(quiet=0.3, limit=120):
+    """Run the mainloop until nothing happened for quiet seconds."""
+    context = gobject.main_context_default()
+    deadline = time.time() + limit
+    last_busy = time.time()
+    while time.time() < deadline:
+        if context.pending():
+            context.iteration(False)
+            last_busy = time.time()
+        elif time.time() - last_busy >= quiet:
+            break
+        else:
+            time.sleep(0.001)
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index] * 1000
+
+
+class Benchmark(object):
+
+    def __init__(self, options):
+        self.options = options
+        dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+        self.recorder = SignalRecorder(dbus.SessionBus())
+        self.roster = make_roster(options.buddies, options.groups, options.rooms)
+        self.results = {}
+
+    def run(self):
+        self.phase('login', self.login)
+        self.phase('presence_storm', self.presence_storm)
+        self.phase('message_flood', self.message_flood)
+        self.phase('room_joins', self.room_joins)
+        self.phase('file_transfers', self.file_transfers)
+        self.phase('disconnect', self.disconnect)
+        return {'parameters': vars(self.options),
+                'phases': self.results,
+                'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+    def phase(self, name, func):
+        self.recorder.reset()
+        wall = time.time()
+        cpu = cpu_time()
+        events = func()
+        settle()
+        # the quiet period of settle() is not part of the phase
+        wall = time.time() - wall - 0.3
+        cpu = cpu_time() - cpu
+
+        latencies = sorted(self.recorder.latencies)
+        self.results[name] = {
+            'events': events,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'signals': dict(self.recorder.counts),
+            'signals_total': sum(self.recorder.counts.values()),
+            'latency_ms': {
+                'count': len(latencies),
+                'p50': percentile(latencies, 0.50),
+                'p90': percentile(latencies, 0.90),
+                'p99': percentile(latencies, 0.99),
+                'max': percentile(latencies, 1.0),
+            },
+        }
+
+    def login(self):
+        handle, path = tempfile.mkstemp(suffix='.jad')
+        os.close(handle)
+        write_jad(path)
+
+        class BenchConnection(MixerConnection):
+            mxit_connection_class = FakeMxitServer.factory(self.roster,
+                    self.options.ack_delay)
+
+        params = {'account': 'loadtest@mxit', 'password': 'secret',
+                'settings-file': path}
+        self.con = BenchConnection(StubManager(), params)
+        os.unlink(path)
+        self.server = self.con.mxit
+
+        self.recorder.expect('StatusChanged', 2)
+        self.recorder.expect('PresenceUpdate', len(self.roster.all_buddies()))
+        self.recorder.expect('AliasesChanged',
+                len(self.roster.all_buddies()) + len(self.roster.all_rooms()))
+        self.con.Connect()
+        return len(self.roster.all_buddies()) + len(self.roster.all_rooms())
+
+    def presence_storm(self):
+        buddies = self.roster.all_buddies()
+        changes = self.options.presence_changes
+        states = [Presence.AWAY, Presence.AVAILABLE, Presence.BUSY]
+        for i in xrange(changes):
+            buddy = buddies[i % len(buddies)]
+            self.recorder.expect('PresenceUpdate')
+            self.server.change_presence(buddy, states[i % len(states)])
+            if i % 100 == 0:
+                self._iterate()
+        return changes
+
+    def message_flood(self):
+        buddies = self.roster.all_buddies()
+        messages = self.options.messages
+        for i in xrange(messages):
+            buddy = buddies[i % len(buddies)]
+            self.recorder.expect('Received')
+            self.server.deliver_message(buddy, 'message %d' % i)
+            if i % 100 == 0:
+                self._iterate()
+        return messages
+
+    def room_joins(self):
+        rooms = self.roster.all_rooms()
+        buddies = self.roster.all_buddies()
+        joins = 0
+        for i, room in enumerate(rooms):
+            members = buddies[i:i + self.options.room_size]
+            self.recorder.expect('Received')
+            self.server.join_room(room, members)
+            joins += len(members)
+        return joins
+
+    def file_transfers(self):
+        data = os.urandom(1024) * (self.options.file_size / 1024)
+        for i in xrange(self.options.files):
+            self.server.deliver_file('file%d.bin' % i, data)
+            self._iterate()
+            for channel in self.con._channel_manager.all_channels():
+                if isinstance(channel, MixerFileChannel) and \
+                        channel.State == FT_STATE_PENDING:
+                    self.recorder.expect('FileTransferStateChanged', 3)
+                    self._download(channel)
+        return self.options.files
+
+    def disconnect(self):
+        self.recorder.expect('StatusChanged')
+        self.con.Disconnect()
+        return 1
+
+    def _download(self, channel):
+        path = channel.AcceptFile(0, 0, '', 0)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        client.setblocking(False)
+        received = 0
+        while True:
+            self._iterate()
+            try:
+                data = client.recv(64 * 1024)
+            except socket.error, e:
+                if e.args[0] == errno.EAGAIN:
+                    continue
+                raise
+            if not data:
+                break
+            received += len(data)
+        client.close()
+        return received
+
+    def _iterate(self):
+        context = gobject.main_context_default()
+        while context.pending():
+            context.iteration(False)
+
+
+def main(args):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('--buddies', type='int', default=1000,
+            help="roster size, 100 to 50000 [%default]")
+    parser.add_option('--groups', type='int', default=20)
+    parser.add_option('--rooms', type='int', default=10)
+    parser.add_option('--room-size', type='int', default=20,
+            help="buddies joining each room [%default]")
+    parser.add_option('--presence-changes', type='int', default=10000)
+    parser.add_option('--messages', type='int', default=10000)
+    parser.add_option('--files', type='int', default=5)
+    parser.add_option('--file-size', type='int', default=1024 * 1024)
+    parser.add_option('--ack-delay', type='int', default=0,
+            help="milliseconds before the server acknowledges a message")
+    parser.add_option('--output', help="write the JSON results to this file")
+    options, rest = parser.parse_args(args)
+
+    results = Benchmark(options).run()
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        output = open(options.output, 'w')
+        output.write(text + '\n')
+        output.close()
+    else:
+        print text
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
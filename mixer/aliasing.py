@@ -25,6 +25,8 @@ import telepathy
 
 from mixer.handle import MixerHandleFactory
 from mixer.util.decorator import async, logexceptions
+from mixer.util.instrument import instrumented
+from mixer.util.batch import SignalBatcher
 
 __all__ = ['MixerAliasing']
 
@@ -32,27 +34,37 @@ logger = logging.getLogger('Mixer.Aliasing')
 
 class MixerAliasing(telepathy.server.ConnectionInterfaceAliasing):
 
+    # Alias changes are merged into one AliasesChanged per mainloop
+    # iteration, or per this many contacts.
+    alias_batch_limit = 500
+
     def __init__(self):
         telepathy.server.ConnectionInterfaceAliasing.__init__(self)
+        self._alias_batch = SignalBatcher(self._flush_aliases,
+                0, self.alias_batch_limit)
 
+    @instrumented('Aliasing.RequestAliases')
     @logexceptions(logger)
     def RequestAliases(self, contacts):
         result = []
         for handle_id in contacts:
             handle = self.handle(telepathy.HANDLE_TYPE_CONTACT, handle_id)
-            contact = handle.contact
-            if contact:
-                alias = contact.name
-                if isinstance(alias, unicode):
-                    result.append(alias)
-                elif alias is None:
-                    result.append(u'None')
-                else:
-                    result.append(unicode(alias, 'utf-8'))
-            else:
-                result.append(handle.jid)
+            result.append(self.alias_for(handle))
         return result
 
+    def alias_for(self, handle):
+        contact = handle.known_contact
+        if contact:
+            alias = contact.name
+            if isinstance(alias, unicode):
+                return alias
+            elif alias is None:
+                return u'None'
+            else:
+                return unicode(alias, 'utf-8')
+        else:
+            return handle.jid
+
     @logexceptions(logger)
     def SetAliases(self, aliases):
         for handle_id, alias in aliases.iteritems():
@@ -69,12 +81,21 @@ class MixerAliasing(telepathy.server.ConnectionInterfaceAliasing):
                 logger.info("Self alias changed to '%s'" % alias)
                 self.mxit.update_profile(name=alias)
        
-    @async
     def _contact_alias_changed(self, contact):
         handle = self.handle_for_buddy(contact)
+        self.contact_changed(handle)
+        self._alias_batch.add(handle, contact)
+
+    def _flush_aliases(self, changes):
+        aliases = []
+        for handle, contact in changes.iteritems():
+            alias = contact.name
+            #alias = unicode(alias, 'utf-8')
+            aliases.append((handle, alias))
+        #logger.info("Aliases changed: %r" % aliases)
+        self.AliasesChanged(aliases)
+
+    def alias_stats(self):
+        return self._alias_batch.stats()
 
-        alias = contact.name
-        #alias = unicode(alias, 'utf-8')
-        #logger.info("Contact %r alias changed to '%s'" % (handle, alias))
-        self.AliasesChanged(((handle, alias), ))
 
@@ -25,9 +25,11 @@ import weakref
 import dbus
 import telepathy
 
-from mixer.util.decorator import async, logexceptions
+from mixer.util.decorator import async, scheduled, logexceptions
+from mixer.util.scheduler import PRIORITY_LOW
 from mixer.handle import MixerHandleFactory
 from mixer.coreproperties import MixerCoreProperties
+from mixer.util.batch import SignalBatcher
 
 from mxit.handles import Presence
 
@@ -57,11 +59,30 @@ class MixerListChannel(
         telepathy.server.ChannelTypeContactList,
         telepathy.server.ChannelInterfaceGroup,
         MixerCoreProperties):
-    "Abstract Contact List channels"
+    """Abstract Contact List channels
+
+    Membership changes of single contacts are merged per handle, the last
+    one wins, and emitted as one MembersChanged per change reason at the
+    next mainloop idle state. Changes that leave a handle where it already
+    is, such as an add followed by a remove, are not signalled.
+
+    The last _filter_contact result of every contact is kept, so that
+    check_buddy can ignore updates that do not change it, such as presence
+    changes, without looking at the member sets."""
+
+    # A batch of membership changes is emitted early when it holds this
+    # many contacts
+    members_batch_limit = 500
 
     def __init__(self, connection, handle):
         self.con = connection
         self.handle = handle
+        self._member_batch = SignalBatcher(self._flush_members,
+                0, self.members_batch_limit)
+        # jid -> last (added, local pending, remote pending) of the contact
+        self._filter_state = {}
+        self.checks = 0
+        self.skipped_checks = 0
         
         telepathy.server.ChannelTypeContactList.__init__(self, connection, handle)
         telepathy.server.ChannelInterfaceGroup.__init__(self)
@@ -125,18 +146,18 @@ class MixerListChannel(
         result = []
         for info in self.GetLocalPendingMembersWithInfo():
             result.append(info[0])
-        logger.info("Local pending membmers: %r" % (result))
+        logger.debug("Local pending membmers: %r", result)
         return result
 
-    @async
+    @scheduled(PRIORITY_LOW)
     def _populate(self, connection):
         added = set()
         local_pending = set()
         remote_pending = set()
         
-        buddies = list(connection.mxit.roster.all_buddies()) + list(connection.mxit.roster.all_rooms())
-        for contact in buddies:
+        for contact in self._candidates(connection.roster_index):
             ad, lp, rp = self._filter_contact(contact)
+            self._filter_state[contact.jid] = (ad, lp, rp)
             if ad or lp or rp:
                 #handle = MixerHandleFactory(self.con, 'contact', contact.jid)
                 handle = self.con.handle_for_buddy(contact)
@@ -146,63 +167,78 @@ class MixerListChannel(
         self.MembersChanged('', added, (), local_pending, remote_pending, 0,
                 telepathy.CHANNEL_GROUP_CHANGE_REASON_NONE)
 
+    def _candidates(self, index):
+        """Contacts from the roster index that may be members of this list."""
+        return index.contacts()
+
     def _filter_contact(self, contact):
         return (False, False, False)
 
     def _contains_handle(self, handle):
-        members, local_pending, remote_pending = self.GetAllMembers()
-        return (handle in members) or (handle in local_pending) or \
-                (handle in remote_pending)
+        # the sets of ChannelInterfaceGroup, without going through GetAllMembers
+        return (handle in self._members) or (handle in self._local_pending) or \
+                (handle in self._remote_pending)
                 
     def buddy_added(self, contact):
-        added = set()
-        local_pending = set()
-        remote_pending = set()
-        
         ad, lp, rp = self._filter_contact(contact)
         if ad or lp or rp:
-            handle = MixerHandleFactory(self.con, 'contact',
-                    contact.jid)
-            if ad: added.add(handle)
-            if lp: local_pending.add(handle)
-            if rp: remote_pending.add(handle)
-        if lp:
-            reason = telepathy.CHANNEL_GROUP_CHANGE_REASON_INVITED
-        else:
-            reason = telepathy.CHANNEL_GROUP_CHANGE_REASON_NONE
-        self.MembersChanged('', added, (), local_pending, remote_pending, 0, reason)
-        
+            self._change_member(contact, (ad, lp, rp))
         
     def check_buddy(self, contact):
-        handle = MixerHandleFactory(self.con, 'contact', contact.jid)
-        added = set()
-        local_pending = set()
-        remote_pending = set()
-        removed = set()
-        ad, lp, rp = self._filter_contact(contact)
-        if ad or lp or rp:
-            if ad: added.add(handle)
-            if lp: local_pending.add(handle)
-            if rp: remote_pending.add(handle)
-        else:
-            if self._contains_handle(handle):
-                removed.add(handle)
+        self.checks += 1
+        flags = self._filter_contact(contact)
+        if self._filter_state.get(contact.jid) == flags:
+            self.skipped_checks += 1
+            return
+        self._change_member(contact, flags)
         
-        if lp:
+    def buddy_removed(self, contact):
+        self._change_member(contact, (False, False, False))
+        self._filter_state.pop(contact.jid, None)
+        
+    def flush_members(self):
+        """Emit the batched membership changes right away."""
+        self._member_batch.flush()
+
+    def member_stats(self):
+        stats = self._member_batch.stats()
+        stats['checks'] = self.checks
+        stats['skipped_checks'] = self.skipped_checks
+        return stats
+
+    def _change_member(self, contact, flags):
+        self._filter_state[contact.jid] = flags
+        handle = MixerHandleFactory(self.con, 'contact', contact.jid)
+        if flags[1]:
             reason = telepathy.CHANNEL_GROUP_CHANGE_REASON_INVITED
         else:
             reason = telepathy.CHANNEL_GROUP_CHANGE_REASON_NONE
-            
-        if added or local_pending or remote_pending or removed:
-            self.MembersChanged('', added, removed, local_pending, remote_pending, 0, reason)
-        
-        
-    def buddy_removed(self, contact):
-        handle = MixerHandleFactory(self.con, 'contact', contact.jid)
-        if self._contains_handle(handle):
-            self.MembersChanged('', (), [handle], (), (), 0, telepathy.CHANNEL_GROUP_CHANGE_REASON_NONE)
+        self._member_batch.add(handle, (flags, reason))
+
+    def _flush_members(self, pending):
+        # reason -> (added, removed, local pending, remote pending)
+        changes = {}
+        for handle, ((ad, lp, rp), reason) in pending.iteritems():
+            if reason not in changes:
+                changes[reason] = (set(), set(), set(), set())
+            added, removed, local_pending, remote_pending = changes[reason]
+            if ad or lp or rp:
+                if ad and handle not in self._members:
+                    added.add(handle)
+                if lp and handle not in self._local_pending:
+                    local_pending.add(handle)
+                if rp and handle not in self._remote_pending:
+                    remote_pending.add(handle)
+            elif self._contains_handle(handle):
+                removed.add(handle)
+        for reason, (added, removed, local_pending, remote_pending) in changes.iteritems():
+            if added or removed or local_pending or remote_pending:
+                self.MembersChanged('', added, removed, local_pending,
+                        remote_pending, 0, reason)
             
     def Close(self):
+        self._member_batch.discard()
+        self._filter_state = {}
         self.con.channel_removed(self)
         telepathy.server.ChannelTypeContactList.Close(self)
 
@@ -229,9 +265,11 @@ class MixerSubscribeListChannel(MixerListChannel):
                 logger.info("Contact: %r" % contact)
                 if not contact.is_subscribed():
                     logger.info("inviting %s" % contact.jid)
-                    self._conn.mxit.invite(contact.jid, contact.name, contact.group)
+                    self._conn.invite_limiter.submit(contact.jid, self._conn.mxit.invite,
+                            contact.jid, contact.name, contact.group)
             else:
-                self._conn.mxit.invite(handle.jid, handle.jid, self._conn.mxit.roster.root_group)
+                self._conn.invite_limiter.submit(handle.jid, self._conn.mxit.invite,
+                        handle.jid, handle.jid, self._conn.mxit.roster.root_group)
             
     
     @logexceptions(logger)
@@ -295,10 +333,7 @@ class MixerPublishListChannel(MixerListChannel):
     def GetLocalPendingMembersWithInfo(self):
         result = []
         
-        for contact in self.con.mxit.roster.all_buddies():
-            if contact.presence != Presence.PENDING:
-                continue
-            
+        for contact in self.con.roster_index.local_pending():
             handle = MixerHandleFactory(self.con, 'contact',
                         contact.jid)
             result.append((handle, handle,
@@ -307,6 +342,9 @@ class MixerPublishListChannel(MixerListChannel):
         return result
             
 
+    def _candidates(self, index):
+        return index.subscribed() + index.local_pending()
+
     def _filter_contact(self, contact):
         if contact:
             return (contact.is_subscribed(), contact.presence == Presence.PENDING, False)
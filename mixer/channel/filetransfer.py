@@ -22,8 +22,12 @@ import logging
 import weakref
 import time
 import socket
+import errno
+import os
+import tempfile
 
 import dbus
+import gobject
 
 import telepathy
 
@@ -34,7 +38,7 @@ from mixer.handle import MixerHandleFactory
 from mixer.coreproperties import MixerCoreProperties
 
 
-__all__ = ['MixerFileChannel']
+__all__ = ['MixerFileChannel', 'SocketStream', 'CHANNEL_TYPE_FILE_TRANSFER']
 
 logger = logging.getLogger('Mixer.FileChannel')
 
@@ -47,6 +51,187 @@ FT_STATE_OPEN = 3
 FT_STATE_COMPLETED = 4
 FT_STATE_CANCELLED = 5
 
+FT_STATE_CHANGE_REASON_NONE = 0
+FT_STATE_CHANGE_REASON_REQUESTED = 1
+FT_STATE_CHANGE_REASON_LOCAL_STOPPED = 2
+FT_STATE_CHANGE_REASON_REMOTE_STOPPED = 3
+FT_STATE_CHANGE_REASON_LOCAL_ERROR = 4
+FT_STATE_CHANGE_REASON_REMOTE_ERROR = 5
+
+SOCKET_ADDRESS_TYPE_UNIX = 0
+SOCKET_ACCESS_CONTROL_LOCALHOST = 0
+
+CHUNK_SIZE = 64 * 1024
+# seconds between two TransferredBytesChanged signals
+PROGRESS_INTERVAL = 0.5
+# milliseconds the client gets to connect to the socket
+ACCEPT_TIMEOUT = 60000
+
+
+class SocketStream(object):
+    """Copy a file between a client on a Unix socket and a file or buffer.
+
+    The sockets are non-blocking and driven by GLib IO watches. Incoming data
+    is read with recv_into into a single fixed size buffer, outgoing data is
+    sent in slices of the source buffer, so memory use does not depend on
+    the size of the file."""
+
+    def __init__(self, opened_func, progress_func, done_func):
+        self._opened = opened_func
+        self._progress = progress_func
+        self._done = done_func
+        self._dir = None
+        self._server = None
+        self._client = None
+        self._watch = None
+        self._timeout = None
+        self.count = 0
+
+    def receive(self, sink, size):
+        """Offer a socket the client writes the file to, which is copied into
+        sink. Returns the path of the socket."""
+        self._sink = sink
+        self._remaining = size or None
+        self._buffer = bytearray(CHUNK_SIZE)
+        self._view = memoryview(self._buffer)
+        self._condition = gobject.IO_IN
+        self._handler = self._read
+        return self._listen()
+
+    def send(self, data, offset=0):
+        """Offer a socket the client reads data from, starting at offset.
+        data can be a string or an mmap. Returns the path of the socket."""
+        self._data = data
+        self._position = offset
+        self._end = len(data)
+        self._condition = gobject.IO_OUT
+        self._handler = self._write
+        return self._listen()
+
+    def cancel(self):
+        self._close()
+
+    def _listen(self):
+        self._dir = tempfile.mkdtemp(prefix='tp-mixer-ft-')
+        path = os.path.join(self._dir, 'socket')
+        logger.info("listening on %s" % path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.setblocking(False)
+        server.bind(path)
+        server.listen(1)
+        self._server = server
+        self._watch = gobject.io_add_watch(server, gobject.IO_IN, self._accept)
+        self._timeout = gobject.timeout_add(ACCEPT_TIMEOUT, self._accept_timeout)
+        return path
+
+    def _accept(self, source, condition):
+        try:
+            client, address = self._server.accept()
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return True
+            logger.error("accept failed: %s" % e)
+            self._watch = None
+            self._finish(False)
+            return False
+
+        self._watch = None
+        self._close_server()
+        client.setblocking(False)
+        self._client = client
+        self._watch = gobject.io_add_watch(client,
+                self._condition | gobject.IO_HUP | gobject.IO_ERR, self._handler)
+        self._opened()
+        return False
+
+    def _accept_timeout(self):
+        logger.warning("No client connected to the file transfer socket")
+        self._timeout = None
+        self._finish(False)
+        return False
+
+    def _read(self, source, condition):
+        size = CHUNK_SIZE
+        if self._remaining is not None:
+            size = min(size, self._remaining)
+        try:
+            received = self._client.recv_into(self._buffer, size)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return True
+            logger.error("receiving file failed: %s" % e)
+            return self._stop(False)
+
+        if received == 0:
+            return self._stop(self._remaining is None)
+
+        self._sink.write(self._view[:received])
+        self.count += received
+        self._progress(self.count)
+        if self._remaining is not None:
+            self._remaining -= received
+            if self._remaining == 0:
+                return self._stop(True)
+        return True
+
+    def _write(self, source, condition):
+        if condition & (gobject.IO_HUP | gobject.IO_ERR):
+            return self._stop(False)
+        # buffer rather than memoryview: mmap only has the old buffer
+        # interface in Python 2
+        try:
+            sent = self._client.send(buffer(self._data, self._position, CHUNK_SIZE))
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return True
+            logger.error("sending file failed: %s" % e)
+            return self._stop(False)
+
+        self._position += sent
+        self.count += sent
+        self._progress(self.count)
+        if self._position >= self._end:
+            return self._stop(True)
+        return True
+
+    def _stop(self, success):
+        self._watch = None
+        self._finish(success)
+        return False
+
+    def _finish(self, success):
+        self._close()
+        self._done(success)
+
+    def _close(self):
+        if self._watch is not None:
+            gobject.source_remove(self._watch)
+            self._watch = None
+        if self._timeout is not None:
+            gobject.source_remove(self._timeout)
+            self._timeout = None
+        self._close_server()
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        self._data = None
+
+    def _close_server(self):
+        if self._timeout is not None:
+            gobject.source_remove(self._timeout)
+            self._timeout = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if self._dir is not None:
+            path = os.path.join(self._dir, 'socket')
+            if os.path.exists(path):
+                os.unlink(path)
+            os.rmdir(self._dir)
+            self._dir = None
+
+
 class MixerFileChannel(
         telepathy.server.Channel,
         MixerCoreProperties):
@@ -56,6 +241,12 @@ class MixerFileChannel(
         
         self.handle = handle
         self.con = connection
+        self._data = None
+        self._spool = None
+        self._offer_timeout = None
+        self._last_progress = 0
+        self._stream = SocketStream(self._stream_opened, self._stream_progress,
+                self._stream_done)
         
         
         telepathy.server.Channel.__init__(self, connection, CHANNEL_TYPE_FILE_TRANSFER, handle)
@@ -71,15 +262,18 @@ class MixerFileChannel(
         
         self._register_rw(CHANNEL_TYPE_FILE_TRANSFER, 'State', 'TransferredBytes')
         
+        ft = CHANNEL_TYPE_FILE_TRANSFER + '.'
         self.State = FT_STATE_PENDING
-        self.ContentType = 'application/octet-stream'
-        self.Filename = 'test.txt'
-        self.Size = 12345
+        self.ContentType = params.get(ft + 'ContentType', 'application/octet-stream')
+        self.Filename = params.get(ft + 'Filename', '')
+        self.Size = params.get(ft + 'Size', 0)
         self.ContentHashType=0
-        self.Description = 'Test file'
-        self.InitialOffset = 0
+        self.Description = params.get(ft + 'Description', '')
+        self.InitialOffset = params.get(ft + 'InitialOffset', 0)
         self.TransferredBytes = 0
-        self.AvailableSocketTypes = {2: [0, 1, 2], 0: dbus.Array([], 'u')}
+        self.AvailableSocketTypes = dbus.Dictionary(
+                {SOCKET_ADDRESS_TYPE_UNIX: [SOCKET_ACCESS_CONTROL_LOCALHOST]},
+                signature='uau')
         
         
         self._register_r('org.freedesktop.Telepathy.Channel', 'ChannelType', 'Interfaces',
@@ -106,23 +300,47 @@ class MixerFileChannel(
     def Interfaces(self):
         return list(self._interfaces)
     
+    def offer(self, spool_file):
+        """Offer a file received from MXit, held in a SpoolFile, to the
+        client."""
+        self._data = spool_file
+        self.Size = len(spool_file)
+        # an offer nobody handles would keep its spool slot until disconnect
+        if self.con.incoming_offer_timeout:
+            self._offer_timeout = gobject.timeout_add(self.con.incoming_offer_timeout,
+                    self._offer_expired)
+    
     @dbus.service.method(CHANNEL_TYPE_FILE_TRANSFER, in_signature='uuvt', out_signature='v')
     def AcceptFile(self, address_type, access_control, access_control_param, offset):
         logger.info("AcceptFile")
-        return "donnie"
+        self._check_socket_type(address_type, access_control)
+        if self._data is None:
+            raise telepathy.NotAvailable("No file to accept")
+        
+        offset = min(offset, len(self._data))
+        self.InitialOffset = offset
+        path = self._stream.send(self._data.map(), offset)
+        self._stop_offer_timeout()
+        self._set_state(FT_STATE_ACCEPTED, FT_STATE_CHANGE_REASON_REQUESTED)
+        self.InitialOffsetDefined(offset)
+        return path
         
     @dbus.service.method(CHANNEL_TYPE_FILE_TRANSFER, in_signature='uuv', out_signature='v')
     def ProvideFile(self, address_type, access_control, access_control_param):
         logger.info("ProvideFile")
+        self._check_socket_type(address_type, access_control)
+        
+        # MXit cannot resume transfers
+        self.InitialOffset = 0
+        self._spool = tempfile.TemporaryFile()
+        path = self._stream.receive(self._spool, self.Size)
+        self._set_state(FT_STATE_ACCEPTED, FT_STATE_CHANGE_REASON_REQUESTED)
         self.InitialOffsetDefined(0)
-        self.FileTransferStateChanged(FT_STATE_OPEN, 1)
-        path, socket = self._create_socket()
-        self._listen(socket)
         return path
    
     @dbus.service.signal(CHANNEL_TYPE_FILE_TRANSFER, signature='uu')
     def FileTransferStateChanged(self, state, reason):
-        self.state = state
+        pass
     
     @dbus.service.signal(CHANNEL_TYPE_FILE_TRANSFER, signature='t')
     def TransferredBytesChanged(self, count):
@@ -135,40 +353,67 @@ class MixerFileChannel(
     
     @logexceptions(logger)
     def Close(self):
+        if self.State not in (FT_STATE_COMPLETED, FT_STATE_CANCELLED):
+            self._stream.cancel()
+            self._set_state(FT_STATE_CANCELLED, FT_STATE_CHANGE_REASON_LOCAL_STOPPED)
+        self._release()
         self.con.channel_removed(self)
         telepathy.server.Channel.Close(self)
     
+    def _check_socket_type(self, address_type, access_control):
+        if self.State != FT_STATE_PENDING:
+            raise telepathy.NotAvailable("The transfer is not pending")
+        if address_type != SOCKET_ADDRESS_TYPE_UNIX or \
+                access_control != SOCKET_ACCESS_CONTROL_LOCALHOST:
+            raise telepathy.NotImplemented("Only Unix sockets with localhost access are supported")
     
-    def _create_socket(self):
-        import tempfile
-        import os
-        import random
-        
-        
-        dir = tempfile.gettempdir()
-        
-        while True:
-            i = random.randint(1, 10000000)
-            path = os.path.join(dir, "tp-ft-%d" % i)
-            if not os.path.exists(path):
-                break
-        logger.info("listening on %s" % path)
-        
-        #server = UnixStreamServer(path, FileSocketHandler)
-        
-        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        server.bind(path)
-        server.listen(1)
-        server.settimeout(5.0)
-        
-        return (path, server)
+    def _set_state(self, state, reason):
+        self.State = state
+        self.FileTransferStateChanged(state, reason)
+    
+    def _stream_opened(self):
+        self._set_state(FT_STATE_OPEN, FT_STATE_CHANGE_REASON_NONE)
     
-    @async
-    def _listen(self, server):
-        (client, address) = server.accept()
-        server.close()
-        descriptor = FileDescriptor(0, name=self.Filename, description=self.Description, size=self.Size, mimetype=self.ContentType)
-        self.con.mxit.send_file(descriptor, self.handle.contact, client.makefile())
+    def _stream_progress(self, count):
+        self.TransferredBytes = self.InitialOffset + count
+        now = time.time()
+        if now - self._last_progress >= PROGRESS_INTERVAL:
+            self._last_progress = now
+            self.TransferredBytesChanged(self.TransferredBytes)
+    
+    def _stream_done(self, success):
+        self.TransferredBytesChanged(self.TransferredBytes)
+        if not success:
+            self._release()
+            self._set_state(FT_STATE_CANCELLED, FT_STATE_CHANGE_REASON_LOCAL_ERROR)
+            return
         
+        if self._spool is not None:
+            self._spool.seek(0)
+            descriptor = FileDescriptor(0, name=self.Filename, description=self.Description,
+                    size=self.TransferredBytes, mimetype=self.ContentType)
+            self.con.mxit.send_file(descriptor, self.handle.contact, self._spool)
+            # the file now belongs to the MXit connection
+            self._spool = None
+        self._release()
+        self._set_state(FT_STATE_COMPLETED, FT_STATE_CHANGE_REASON_NONE)
+    
+    def _offer_expired(self):
+        self._offer_timeout = None
+        logger.info("%s was not accepted in time, cancelling" % self.Filename)
+        self.Close()
+        return False
+
+    def _stop_offer_timeout(self):
+        if self._offer_timeout is not None:
+            gobject.source_remove(self._offer_timeout)
+            self._offer_timeout = None
 
-        
\ No newline at end of file
+    def _release(self):
+        self._stop_offer_timeout()
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
@@ -39,6 +39,7 @@ class MixerGroupChannel(MixerListChannel):
         self.__pending_add = []
         self.__pending_remove = []
         MixerListChannel.__init__(self, connection, handle)
+        connection.group_channel_created(self)
         
         self.GroupFlagsChanged(telepathy.CHANNEL_GROUP_FLAG_CAN_ADD | 
                 telepathy.CHANNEL_GROUP_FLAG_CAN_REMOVE | telepathy.CHANNEL_GROUP_FLAG_ONLY_ONE_GROUP | telepathy.CHANNEL_GROUP_FLAG_PROPERTIES, 0)
@@ -83,6 +84,9 @@ class MixerGroupChannel(MixerListChannel):
         # Groups in MXit are never actually deleted
         logger.debug("\"Deleting\" group %s" % self._handle.name)
 
+    def _candidates(self, index):
+        return index.group_members(self._handle.name)
+
     def _filter_contact(self, contact):
         if contact.group.name == self._handle.name:
             return (True, False, False)
@@ -28,8 +28,10 @@ import dbus.service
 from mxit.handles import *
 
 from mixer.util.decorator import async, logexceptions
+from mixer.util.instrument import instrumented
 from mixer.handle import MixerHandleFactory
 from mixer.properties import MixerProperties
+from mixer.pending import MixerPendingMessages
 
 __all__ = ['MixerRoomChannel']
 
@@ -37,16 +39,17 @@ logger = logging.getLogger('Mixer.RoomChannel')
 
 
 class MixerRoomChannel(
+        MixerPendingMessages,
         telepathy.server.ChannelTypeText,
         telepathy.server.ChannelInterfaceGroup,
         MixerProperties):
 
     def __init__(self, connection, handle):
-        self._recv_id = 0
         self.handle = handle
         self.con = connection
 
         telepathy.server.ChannelTypeText.__init__(self, connection, handle)
+        MixerPendingMessages.__init__(self)
         telepathy.server.ChannelInterfaceGroup.__init__(self)
         # ('description', 's', 1), ('subject', 's', 1)
         MixerProperties.__init__(self, [('invite-only', 'b', 1), ('name', 's', 1), ('private', 'b', 1)])
@@ -72,6 +75,7 @@ class MixerRoomChannel(
                 
     
     
+    @instrumented('RoomText.Send')
     @logexceptions(logger)
     def Send(self, message_type, text):
         if self.handle.room:
@@ -79,7 +83,7 @@ class MixerRoomChannel(
                 if text.startswith('/'):
                     self.con.commands.handle_command(self, text)
                 else:
-                    self.con.mxit.message(self.handle.room, text)
+                    self.con.send_message(self.handle.room, text)
             else:
                 raise telepathy.NotImplemented("Unhandled message type")
         else:
@@ -121,13 +125,13 @@ class MixerRoomChannel(
         
         
     def message_received(self, contact_handle, message, type=telepathy.CHANNEL_TEXT_MESSAGE_TYPE_NORMAL):
-        id = self._recv_id
+        id = self.next_message_id()
         timestamp = int(time.time())
         
         self.Received(id, timestamp, contact_handle, type, 0, message.message)
 
     def buddies_joined(self, buddies):
-        logger.info("joined: %s" % (buddies))
+        logger.debug("joined: %s", buddies)
         handles = map(self.con.handle_for_buddy, buddies)
         
         self.MembersChanged('', handles, [], [], [],
@@ -60,13 +60,13 @@ class MixerRoomListChannel(
 
     @dbus.service.method('org.freedesktop.DBus.Properties', in_signature='s', out_signature='a{sv}')
     def GetAll(self, interface):
-        logger.info("getall %s" % interface)
+        logger.debug("getall %s", interface)
         return {'Server': 'test.server.com'}
     
     
     @dbus.service.method('org.freedesktop.DBus.Properties', in_signature='ss', out_signature='v')
     def Get(self, interface, name):
-        logger.info("Get %s" % name)
+        logger.debug("Get %s", name)
         return "my.server.com"
     
         
@@ -30,8 +30,10 @@ import telepathy
 from mxit.handles import *
 
 from mixer.util.decorator import async, logexceptions
+from mixer.util.instrument import instrumented
 from mixer.handle import MixerHandleFactory
 from mixer.coreproperties import MixerCoreProperties
+from mixer.pending import MixerPendingMessages
 
 __all__ = ['MixerTextChannel']
 
@@ -39,16 +41,17 @@ logger = logging.getLogger('Mixer.TextChannel')
 
 
 class MixerTextChannel(
+        MixerPendingMessages,
         telepathy.server.ChannelTypeText,
         MixerCoreProperties):
 
     def __init__(self, connection, handle, params):
-        self._recv_id = 0
         self.contact_handle = handle
         self.handle = handle
         self.con = connection
 
         telepathy.server.ChannelTypeText.__init__(self, connection, handle)
+        MixerPendingMessages.__init__(self)
         MixerCoreProperties.__init__(self)
         
         self._register_r('org.freedesktop.Telepathy.Channel', 'ChannelType', 'Interfaces',
@@ -69,6 +72,7 @@ class MixerTextChannel(
     def Interfaces(self):
         return list(self._interfaces)
     
+    @instrumented('Text.Send')
     @logexceptions(logger)
     def Send(self, message_type, text):
         contact = self.contact_handle.contact
@@ -78,7 +82,7 @@ class MixerTextChannel(
                 self.con.commands.handle_command(self, text)
             else:
                 if contact:
-                    self.con.mxit.message(self.contact_handle.contact, text)
+                    self.con.send_message(contact, text)
                 else:
                     raise telepathy.PermissionDenied("Contact does not exist")
         else:
@@ -90,7 +94,7 @@ class MixerTextChannel(
         telepathy.server.ChannelTypeText.Close(self)
         
     def message_received(self, message, type=telepathy.CHANNEL_TEXT_MESSAGE_TYPE_NORMAL):
-        id = self._recv_id
+        id = self.next_message_id()
         timestamp = int(time.time())
         contact_handle = self.con.handle_for_buddy(message.buddy)
         self.Received(id, timestamp, contact_handle, type, 0, message.message)
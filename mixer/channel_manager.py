@@ -41,14 +41,16 @@ logger = logging.getLogger('Mixer.ChannelManager')
         
         
 class ChannelType:
-    def __init__(self, channel_class, identifiers, fixed, allowed):
+    def __init__(self, channel_class, identifiers, fixed, allowed, unique=False):
         self.channel_class = channel_class
         self.identifiers = identifiers
         self.fixed = fixed
         self.allowed = allowed
+        # every request creates a new channel, e.g. one per file transfer
+        self.unique = unique
         
     def create(self, connection, handle, params):
-        logger.info("Creating new instance of %r" % self.channel_class)
+        logger.debug("Creating new instance of %r", self.channel_class)
         return self.channel_class(connection, handle, params)
         
     def filter_identifiers(self, params):
@@ -80,7 +82,7 @@ class ChannelManager:
         group_fixed = {CHANNEL_TYPE: 'org.freedesktop.Telepathy.Channel.Type.ContactList',  HANDLE_TYPE: telepathy.HANDLE_TYPE_GROUP}
         list_fixed = {CHANNEL_TYPE: 'org.freedesktop.Telepathy.Channel.Type.ContactList',  HANDLE_TYPE: telepathy.HANDLE_TYPE_LIST}
         
-        filetype = ChannelType(MixerFileChannel, basic, ft_fixed, ch_allowed + ft_allowed)
+        filetype = ChannelType(MixerFileChannel, basic, ft_fixed, ch_allowed + ft_allowed, unique=True)
         texttype = ChannelType(MixerTextChannel, basic, text_fixed, ch_allowed)
         grouptype = ChannelType(MixerGroupChannel, basic, group_fixed, ch_allowed)
         listtype = ChannelType(MixerContactListChannelFactory, basic, list_fixed, ch_allowed)
@@ -88,6 +90,11 @@ class ChannelManager:
         self.channel_types = [filetype, texttype, grouptype, listtype]
         
         self._channels = {}
+        # (channel type, handle type, handle id) -> channel, so that
+        # channel_for can skip building and matching request parameters
+        self._targets = {}
+        self._channel_keys = {}
+        self._unique_id = 0
      
         
     def check_handle(self, params, suppress_handler=False):
@@ -111,19 +118,48 @@ class ChannelManager:
                 type = t
                 
         if not type:
-            logger.error("No matching channel type found for %r" % (params))
+            logger.error("No matching channel type found for %r", params)
             return (None, False)
         
-        key = self._build_key(type, params)
+        if type.unique:
+            self._unique_id += 1
+            key = (type, self._unique_id)
+            target = None
+        else:
+            key = self._build_key(type, params)
+            target = self._build_target(params)
         
         if key in self._channels:
-            return self._channels[key], False
+            ch = self._channels[key]
+            self._index(ch, key, target)
+            return ch, False
         else:
             ch = type.create(self.con, handle, params)
             self._channels[key] = ch
+            self._index(ch, key, target)
             self.con.channel_created(ch, suppress_handler)
             return ch, True
     
+    def remove_channel(self, channel):
+        key, targets = self._channel_keys.pop(channel, (None, ()))
+        if self._channels.get(key) is channel:
+            del self._channels[key]
+        for target in targets:
+            if self._targets.get(target) is channel:
+                del self._targets[target]
+    
+    def _index(self, channel, key, target):
+        if channel not in self._channel_keys:
+            self._channel_keys[channel] = (key, set())
+        if target is not None:
+            self._targets[target] = channel
+            self._channel_keys[channel][1].add(target)
+    
+    def _build_target(self, params):
+        return (params.get('org.freedesktop.Telepathy.Channel.ChannelType'),
+                params.get('org.freedesktop.Telepathy.Channel.TargetHandleType'),
+                params.get('org.freedesktop.Telepathy.Channel.TargetHandle'))
+    
     
     def _build_key(self, type, params):
         ident = type.filter_identifiers(params)
@@ -135,12 +171,17 @@ class ChannelManager:
         channel, created = self.create_channel(params, suppress_handler)
         return channel
         
-    def channel_for(self, type, handle, suppress_handler=False):
+    def channel_for(self, type, handle, suppress_handler=False, properties=None):
+        channel = self._targets.get((type, handle.type, handle.id))
+        if channel is not None:
+            return channel
         params = {'org.freedesktop.Telepathy.Channel.TargetHandleType': handle.type,
                   'org.freedesktop.Telepathy.Channel.TargetHandle': handle.id,
                   'org.freedesktop.Telepathy.Channel.TargetHandleID': handle.name,
                   'org.freedesktop.Telepathy.Channel.ChannelType': type
                   }
+        if properties:
+            params.update(properties)
         return self.get_channel(params, suppress_handler)
         
     def channel_for_text(self, handle, suppress_handler=False):
@@ -152,8 +193,8 @@ class ChannelManager:
     def channel_for_list(self, handle, suppress_handler=False):
         return self.channel_for('org.freedesktop.Telepathy.Channel.Type.ContactList', handle, suppress_handler)
     
-    def channel_for_file(self, handle, suppress_handler=False):
-        return self.channel_for('org.freedesktop.Telepathy.Channel.Type.FileTransfer.DRAFT', handle, suppress_handler)
+    def channel_for_file(self, handle, properties=None, suppress_handler=False):
+        return self.channel_for('org.freedesktop.Telepathy.Channel.Type.FileTransfer.DRAFT', handle, suppress_handler, properties)
     
     
     def list_channels(self):
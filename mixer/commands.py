@@ -21,10 +21,12 @@
 
 import logging
 import exceptions
+import time
 
 from mixer.util.decorator import async, logexceptions
 from mixer.channel.text import MixerTextChannel
 from mixer.channel.multitext import MixerRoomChannel
+from mixer.history import DIRECTION_SENT
 
 from mxit.handles import Mood
 
@@ -77,7 +79,7 @@ class CommandHandler:
             return getattr(Mood, text)
         
     def _handle_command(self, command, channel, *args):
-        logger.info("COMMAND %s, %s, %s" % (command, channel, args))
+        logger.info("COMMAND %s, %s, %s", command, channel, args)
         if hasattr(self, command):
             f = self._get_func(command)
             try:
@@ -106,6 +108,7 @@ class CommandHandler:
             /mood - set your mood
             /create - create a MultiMX room
             /invite - invite a buddy to a MultiMX room
+            /history - show the last messages of a conversation
             """
         self.con.info(doc, channel)
         
@@ -120,7 +123,8 @@ class CommandHandler:
         buddy, args = self.get_buddy(None, args)
         logger.info("Inviting %s to room %s" % (buddy, room))
         if room and buddy:
-            self.con.mxit.invite_buddies_room(room, [buddy])
+            self.con.invite_limiter.submit((room.jid, buddy.jid),
+                    self.con.mxit.invite_buddies_room, room, [buddy])
         else:
             raise exceptions.Exception("Invalid room or buddy")
         
@@ -151,6 +155,45 @@ class CommandHandler:
         else:
             raise exceptions.Exception("Name must be specified")
         
+    def history(self, channel, *args):
+        """ Usage: /history [buddy] [count]
+        
+        Shows the last count (default 20) messages with buddy, or with the
+        contact or room of this conversation.
+        """
+        if self.con.history is None:
+            raise exceptions.Exception("No history is kept")
+        contact = None
+        if isinstance(channel, MixerTextChannel):
+            contact = channel.contact_handle.contact
+        # a lone number in a conversation is the count, not a buddy
+        if args and (len(args) > 1 or not args[0].isdigit() or not contact):
+            buddy, rest = self.get_buddy(None, args)
+            if not buddy:
+                buddy, rest = self.get_room(None, args)
+            args = rest
+        else:
+            buddy = contact
+        if not buddy:
+            raise exceptions.Exception("Invalid buddy")
+        count = 20
+        if args and args[0].isdigit():
+            count = int(args[0])
+        
+        lines = []
+        for timestamp, direction, text in self.con.history.last(buddy.jid, count):
+            if direction == DIRECTION_SENT:
+                name = 'me'
+            else:
+                name = buddy.name
+                if isinstance(name, str):
+                    name = name.decode('utf-8', 'replace')
+            when = time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))
+            lines.append(u"[%s] %s: %s" % (when, name, text))
+        if not lines:
+            lines.append(u"No messages with %s" % buddy.name)
+        self.con.info(u"\n".join(lines), channel)
+        
     def mood(self, channel, *args):
         """ Usage: /mood <mood>
         
@@ -20,11 +20,13 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import os
 import weakref
 import logging
 import exceptions
 import time
 
+import gobject
 import telepathy
 from telepathy._generated.Connection_Interface_Requests import ConnectionInterfaceRequests
 
@@ -32,19 +34,31 @@ import dbus
 
 from mxit.connection import MxitConnection
 from mxit.handles import Status, StatusChangeReason, BuddyType, Message
-from mxit.jadreader import read_jad, parse_url
 
 from mixer.listener import MixerListener
-from mixer.presence import MixerPresence
+from mixer.presence import MixerPresence, CONNECTION_INTERFACE_SIMPLE_PRESENCE
 from mixer.aliasing import MixerAliasing
+from mixer.contacts import MixerContacts, CONNECTION_INTERFACE_CONTACTS
+from mixer.contactgroups import MixerContactGroups, CONNECTION_INTERFACE_CONTACT_GROUPS
 from mixer.commands import CommandHandler
-from mixer.handle import MixerHandleFactory, MixerSelfHandle
+from mixer.handle import MixerHandleFactory, MixerHandleRegistry, MixerSelfHandle
 from mixer.channel.contact_list import MixerListChannel
 from mixer.channel.group import MixerGroupChannel
 from mixer.channel.multitext import MixerRoomChannel
+from mixer.channel.filetransfer import CHANNEL_TYPE_FILE_TRANSFER
 from mixer.channel_manager import ChannelManager
-from mixer.util.decorator import async, logexceptions
+from mixer.roster import MixerRosterIndex
+from mixer.rostercache import RosterCache
+from mixer.spool import TransferSpool
+from mixer.outbox import MessageQueue, QueueFull
+from mixer.history import HistoryStore
+from mixer.util.decorator import async, scheduled, logexceptions
+from mixer.util.instrument import instrumented
+from mixer.util.scheduler import PRIORITY_HIGH
+from mixer.util.backoff import Backoff
+from mixer.util.ratelimit import RateLimiter, OVERFLOW_REJECT, OVERFLOW_COALESCE
 from mixer.coreproperties import MixerCoreProperties
+from mixer.util.helpers import prefix
 
 __all__ = ['MixerConnection']
 
@@ -56,6 +70,8 @@ logger = logging.getLogger('Mixer.Connection')
 class MixerConnection(telepathy.server.Connection,
                       MixerPresence,
                       MixerAliasing,
+                      MixerContacts,
+                      MixerContactGroups,
                       ConnectionInterfaceRequests,
                       MixerCoreProperties):
     _mandatory_parameters = {
@@ -63,8 +79,51 @@ class MixerConnection(telepathy.server.Connection,
             'password' : 's',
             'settings-file' : 's',
             }
-    _parameter_defaults = {}
-    _optional_parameters = {}
+    _parameter_defaults = {
+            'auto-reconnect' : False,
+            }
+    _optional_parameters = {
+            'auto-reconnect' : 'b',
+            }
+    
+    # Creates the MXit protocol connection; benchmarks replace it with a
+    # local stand-in server
+    mxit_connection_class = MxitConnection
+    
+    # Outgoing messages are paced per recipient, and refused once this many
+    # are waiting. Repeated invites for the same contact are merged.
+    message_rate = 2.0
+    message_burst = 5
+    message_queue = 100
+    invite_rate = 0.5
+    invite_burst = 3
+    
+    # Send returns as soon as the message is queued. At most message_window
+    # messages are on their way to the server at once; messages that are
+    # not acknowledged within message_ack_timeout ms are reported as failed.
+    message_window = 16
+    message_backlog = 1000
+    message_ack_timeout = 60000
+    
+    # Incoming files are spooled to disk until the client accepts them
+    max_incoming_transfers = 4
+    incoming_quota = 256 * 1024 * 1024
+    # milliseconds a received file waits for the client to accept it
+    incoming_offer_timeout = 300000
+    
+    # The roster is cached next to the settings file. Cached contacts that
+    # the server has not sent this many milliseconds after login are removed.
+    roster_reconcile_delay = 15000
+    
+    # Messages are logged to <account>.history next to the settings file
+    history_enabled = True
+    
+    # With auto-reconnect a lost MXit connection is retried after 1s, 2s,
+    # 4s, ... (with jitter, at most reconnect_max_delay) for up to
+    # reconnect_budget attempts, keeping the channels and handles.
+    reconnect_initial_delay = 1000
+    reconnect_max_delay = 300000
+    reconnect_budget = 10
 
     @logexceptions(logger)
     def __init__(self, manager, parameters):
@@ -72,18 +131,44 @@ class MixerConnection(telepathy.server.Connection,
         self._manager = manager
         account = parameters['account']
         settings_file = parameters['settings-file']
-        file = open(settings_file, "r")
-        settings = read_jad(file)
-        file.close()
-        protocol, host, port, path = parse_url(settings['sl1'])
-        
-        logger.info("Settings: %s" % settings_file)
+        settings = manager.settings_cache.get(settings_file)
         #server = parameters['server'].encode('utf-8')
         #port = parameters['port']
         
         self._account = account
+        self._auto_reconnect = bool(parameters['auto-reconnect'])
+        self.reconnecting = False
+        self._torn_down = False
+        self.reconnector = Backoff(self._reconnect_now, self.reconnect_initial_delay,
+                self.reconnect_max_delay, budget=self.reconnect_budget)
         
         self._channel_manager = ChannelManager(self)
+        # group name -> group channel, and jid -> the group channel the
+        # buddy is shown in, so a group move touches two channels only
+        self._group_channels = {}
+        self._buddy_groups = {}
+        self.roster_index = MixerRosterIndex()
+        self.roster_cache = RosterCache(self._account_path(settings_file, account, 'roster'))
+        for buddy in self.roster_cache.load():
+            self.roster_index.update(buddy)
+        self._reconcile_source = None
+        self.history = None
+        if self.history_enabled:
+            history_path = self._account_path(settings_file, account, 'history')
+            try:
+                self.history = HistoryStore(history_path)
+            except (IOError, OSError), e:
+                logger.warning("Message history disabled, could not open %s: %s",
+                        history_path, e)
+        self.message_limiter = RateLimiter(self.message_rate, self.message_burst,
+                self.message_queue, OVERFLOW_REJECT)
+        self.invite_limiter = RateLimiter(self.invite_rate, self.invite_burst,
+                0, OVERFLOW_COALESCE)
+        self.outbox = MessageQueue(self._transmit_message, self.message_limiter,
+                self._message_failed, self.message_window, self.message_backlog,
+                self.message_ack_timeout)
+        self.transfer_spool = TransferSpool(self.max_incoming_transfers,
+                self.incoming_quota)
         
         # Call parent initializers
         try:
@@ -93,12 +178,20 @@ class MixerConnection(telepathy.server.Connection,
         ConnectionInterfaceRequests.__init__(self)
         MixerPresence.__init__(self)
         MixerAliasing.__init__(self)
+        MixerContacts.__init__(self)
+        MixerContactGroups.__init__(self)
         MixerCoreProperties.__init__(self)
         
+        self._handle_registry = MixerHandleRegistry(self._handles)
+        
         self._register_r('org.freedesktop.Telepathy.Connection.Interface.Requests', 'RequestableChannelClasses', 'Channels')
+        self._register_r(CONNECTION_INTERFACE_CONTACTS, 'ContactAttributeInterfaces')
+        self._register_r(CONNECTION_INTERFACE_SIMPLE_PRESENCE, 'Statuses')
+        self._register_r(CONNECTION_INTERFACE_CONTACT_GROUPS, 'DisjointGroups',
+                'GroupStorage', 'Groups')
         
         self.set_self_handle(MixerHandleFactory(self, 'self'))
-        con = MxitConnection(host=host, port=port, client_id=settings['c'], country_code=int(settings['cc']), language=settings['loc'])
+        con = self.mxit_connection_class(host=settings.host, port=settings.port, client_id=settings.client_id, country_code=settings.country_code, language=settings.language)
         con.listeners.add(MixerListener(self))
         con.id = account.split('@')[0]
         con.password = parameters['password']
@@ -129,7 +222,11 @@ class MixerConnection(telepathy.server.Connection,
         if handle_type == 0 and handle_id == 0:
             return MixerHandleFactory(self, 'none')    #HACK
         self.check_handle(handle_type, handle_id)
-        return self._handles[handle_type, handle_id]
+        return self._handle_registry.get(handle_type, handle_id)
+
+    def add_client_handle(self, handle, sender):
+        telepathy.server.Connection.add_client_handle(self, handle, sender)
+        self._handle_registry.hold(handle, sender)
 
     @logexceptions(logger)
     def Connect(self):
@@ -147,8 +244,15 @@ class MixerConnection(telepathy.server.Connection,
     @logexceptions(logger)
     def Disconnect(self):
         logger.info("Disconnecting")
+        if self.reconnecting:
+            # tear down now, the closed MXit connection may never report
+            # DISCONNECTED again
+            self.flush_signals()
+            self.disconnected(telepathy.CONNECTION_STATUS_REASON_REQUESTED)
+        # also aborts a reconnect attempt that is still in progress
         self.mxit.close()
 
+    @instrumented('Connection.RequestHandles')
     @logexceptions(logger)
     def RequestHandles(self, handle_type, names, sender):   
         self.check_connected()
@@ -162,6 +266,12 @@ class MixerConnection(telepathy.server.Connection,
             self.add_client_handle(handle, sender)
         return handles
         
+    @logexceptions(logger)
+    def ReleaseHandles(self, handle_type, handles, sender):
+        telepathy.server.Connection.ReleaseHandles(self, handle_type, handles, sender)
+        for handle_id in handles:
+            self._handle_registry.release(handle_type, handle_id, sender)
+        
     def get_handle(self, handle_type, name):
         if handle_type == telepathy.HANDLE_TYPE_CONTACT:
             handle = MixerHandleFactory(self, 'contact', name)
@@ -180,9 +290,10 @@ class MixerConnection(telepathy.server.Connection,
             raise telepathy.NotAvailable('Handle type unsupported %d' % handle_type)
         return handle
     
+    @instrumented('Connection.CreateChannel')
     @logexceptions(logger)
     def CreateChannel(self, request):
-        logger.info('CreateChannel %r' % request)
+        logger.info('CreateChannel %r', request)
         channel, created = self._channel_manager.create_channel(request, True)
         if not created:
             raise telepathy.NotAvailable('Channel already exists: %r' % request)
@@ -191,27 +302,37 @@ class MixerConnection(telepathy.server.Connection,
         props = channel.identifiers()
         return (channel._object_path, props)
     
-    @async
+    @scheduled(PRIORITY_HIGH)
     def channel_created(self, channel, suppress_handler):
         ident = channel.identifiers()
-        logger.info("New Channel: %r" % ident)
+        logger.info("New Channel: %r", ident)
         self.NewChannels([(channel._object_path, ident)])
         self.add_channel(channel, channel.handle, suppress_handler)
         
-    @async
     def channel_removed(self, channel):
+        self._channel_manager.remove_channel(channel)
+        if isinstance(channel, MixerGroupChannel) and \
+                self._group_channels.get(channel.handle.name) is channel:
+            del self._group_channels[channel.handle.name]
+            self._buddy_groups = dict([(jid, group) for jid, group
+                    in self._buddy_groups.iteritems() if group is not channel])
+        self._channel_closed(channel)
+        
+    @scheduled(PRIORITY_HIGH)
+    def _channel_closed(self, channel):
         self.ChannelClosed(channel._object_path)
         #channel.remove_from_connection()
         
     @logexceptions(logger)
     def EnsureChannel(self, request):
-        logger.info('EnsureChannel %r' % request)
+        logger.info('EnsureChannel %r', request)
         channel, created = self._channel_manager.create_channel(request, True)
         props = channel.identifiers()
         
         #TODO: also 'Yours' if created by the connection manager
         return (created, channel._object_path, props)
     
+    @instrumented('Connection.RequestChannel')
     @logexceptions(logger)
     def RequestChannel(self, type, handle_type, handle_id, suppress_handler):    
         self.check_connected()
@@ -251,10 +372,7 @@ class MixerConnection(telepathy.server.Connection,
 
     def group_for_buddy(self, buddy):
         if not buddy.group.is_root():
-            group_name = buddy.group.name
-            group_handle = MixerHandleFactory(self, 'group', group_name)
-            channel = self._channel_manager.channel_for_list(group_handle)
-            return channel
+            return self.get_group_channel(buddy.group.name)
         else:
             return None
         
@@ -268,11 +386,54 @@ class MixerConnection(telepathy.server.Connection,
         #for name in ['subscribe', 'publish', 'hide', 'allow', 'deny']:
         for name in ['subscribe', 'publish']:
             self.get_list_channel(name)
+        # groups known from the roster cache
+        for name in self.roster_index.groups():
+            self.get_group_channel(name)
+        if self._reconcile_source is None:
+            self._reconcile_source = gobject.timeout_add(self.roster_reconcile_delay,
+                    self._reconcile_roster)
         
     def get_list_channel(self, name):
         handle = MixerHandleFactory(self, 'list', name)
         return self._channel_manager.channel_for_list(handle)
     
+    def get_group_channel(self, name):
+        channel = self._group_channels.get(name)
+        if channel is None:
+            handle = MixerHandleFactory(self, 'group', name)
+            channel = self._channel_manager.channel_for_list(handle)
+        return channel
+
+    def group_channel_created(self, channel):
+        """Called by new group channels, which start out with the members
+        the roster index has for their group."""
+        name = channel.handle.name
+        self._group_channels[name] = channel
+        for buddy in self.roster_index.group_members(name):
+            self._buddy_groups[buddy.jid] = channel
+
+    def move_to_group(self, buddy):
+        """Show buddy in the channel of its current group, and remove it from
+        the channel it was shown in before."""
+        handle = self.handle_for_buddy(buddy)
+        self.contact_changed(handle)
+        self.group_changed(handle, self.roster_index.group_of(buddy.jid))
+        old = self._buddy_groups.pop(buddy.jid, None)
+        new = self.group_for_buddy(buddy)
+        if old is not None and old is not new:
+            old.buddy_removed(buddy)
+        if new is not None:
+            self._buddy_groups[buddy.jid] = new
+            new.buddy_added(buddy)
+
+    def leave_group(self, buddy):
+        handle = self.handle_for_buddy(buddy)
+        self.contact_changed(handle)
+        self.group_changed(handle, None)
+        channel = self._buddy_groups.pop(buddy.jid, None)
+        if channel is not None:
+            channel.buddy_removed(buddy)
+    
     def get_buddy_channel(self, buddy):    
         handle = self.handle_for_buddy(buddy)
         return self._channel_manager.channel_for_text(handle)
@@ -285,15 +446,155 @@ class MixerConnection(telepathy.server.Connection,
     def get_file_channel(self, descriptor):
         info = self.mxit.roster.info_buddy
         handle = self.handle_for_buddy(info)
-        return self._channel_manager.channel_for_file(handle)
+        properties = prefix(CHANNEL_TYPE_FILE_TRANSFER + '.',
+                Filename=descriptor.name, Size=descriptor.size,
+                ContentType=descriptor.mimetype, Description=descriptor.description)
+        return self._channel_manager.channel_for_file(handle, properties)
         
     def get_group_channels(self):
-        channels = []
-        for ch in self._channel_manager.list_channels():
-            if isinstance(ch, MixerGroupChannel):
-                channels.append(ch)
-        return channels
+        return self._group_channels.values()
+
+    def list_stats(self):
+        """Membership stats of the list and group channels, by name."""
+        return dict([(channel.handle.name, channel.member_stats())
+                for channel in self._channel_manager.list_channels()])
+
+    def connection_stats(self):
+        """Counters of the signal batches and the contact records, by
+        section, with one 'list/<name>' section per list or group channel."""
+        stats = {'presence': self.presence_stats(),
+                 'aliases': self.alias_stats(),
+                 'groups': self.group_stats(),
+                 'contacts': self.contact_stats()}
+        for name, members in self.list_stats().iteritems():
+            stats['list/%s' % name] = members
+        return stats
+            
+    def send_message(self, buddy, text):
+        """Queue a message to buddy in the outbox, see MessageQueue.
+        Returns the message token."""
+        try:
+            return self.outbox.submit(buddy, text)
+        except QueueFull:
+            raise telepathy.NotAvailable("Too many messages waiting to be sent")
             
+    def _transmit_message(self, buddy, text):
+        self.mxit.message(buddy, text)
+        
+    def _message_failed(self, message):
+        channel = self.get_buddy_channel(message.buddy)
+        channel.SendError(int(message.submitted), telepathy.CHANNEL_TEXT_SEND_ERROR_UNKNOWN,
+                telepathy.CHANNEL_TEXT_MESSAGE_TYPE_NORMAL, message.text)
+            
+    def flush_signals(self):
+        """Emit the presence, alias, group and membership changes that are
+        still batched."""
+        self._presence_batch.flush()
+        self._alias_batch.flush()
+        self._group_batch.flush()
+        for channel in self._channel_manager.list_channels():
+            channel.flush_members()
+            
+    def save_roster(self):
+        """Write the current roster to the roster cache."""
+        if self._reconcile_source is not None:
+            gobject.source_remove(self._reconcile_source)
+            self._reconcile_source = None
+        self.roster_cache.save(self.roster_index.contacts())
+        
+    def _reconcile_roster(self):
+        self._reconcile_source = None
+        stale = self.roster_cache.stale()
+        if stale:
+            logger.info("Removing %d cached contacts not on the server" % len(stale))
+        for buddy in stale:
+            self.roster_index.remove(buddy)
+            for channel in map(self.get_list_channel, ['subscribe', 'publish']):
+                channel.buddy_removed(buddy)
+            self.leave_group(buddy)
+        self.save_roster()
+        return False
+        
+    def log_message(self, direction, buddy, text, timestamp=None):
+        """Add a message to the history, if it is kept."""
+        if self.history is not None:
+            self.history.record(direction, buddy.jid, text, timestamp)
+        
+    def _account_path(self, settings_file, account, extension):
+        name = account.split('@')[0].replace(os.sep, '_')
+        directory = os.path.dirname(os.path.abspath(settings_file))
+        return os.path.join(directory, '%s.%s' % (name, extension))
+        
+    def connected(self, reason):
+        """The MXit connection became active."""
+        if self._torn_down:
+            # a reconnect attempt finished after Disconnect
+            return
+        if self.reconnecting:
+            logger.info("Reconnected after %d attempts" % self.reconnector.attempts)
+            self.reconnecting = False
+            self.reconnector.reset()
+            self.outbox.resume()
+        else:
+            self.StatusChanged(telepathy.CONNECTION_STATUS_CONNECTED, reason)
+        self.init_channels()
+        
+    def reconnect(self, reason):
+        """The MXit connection was lost for the given StatusChangeReason.
+        
+        Returns True if another attempt was scheduled, False if the
+        connection has to be torn down."""
+        if not self._auto_reconnect or \
+                reason in (StatusChangeReason.REQUESTED, StatusChangeReason.AUTH_FAILED):
+            return False
+        if not self.reconnecting and self._status != telepathy.CONNECTION_STATUS_CONNECTED:
+            return False
+        if not self.reconnector.schedule():
+            logger.warning("Giving up after %d reconnect attempts" % self.reconnector.attempts)
+            return False
+        if not self.reconnecting:
+            logger.info("Connection lost, reconnecting")
+            self.reconnecting = True
+            # compare the roster the server sends next with the current one
+            self.roster_cache.expect(self.roster_index.contacts())
+            self.message_limiter.cancel()
+            self.invite_limiter.cancel()
+            # queued messages wait for the reconnect, those already sent are lost
+            for message in self.outbox.hold():
+                self._message_failed(message)
+        return True
+        
+    def disconnected(self, reason):
+        """Tear the connection down after the MXit connection was closed."""
+        if self._torn_down:
+            return
+        self._torn_down = True
+        self.reconnecting = False
+        self.reconnector.cancel()
+        self.StatusChanged(telepathy.CONNECTION_STATUS_DISCONNECTED, reason)
+        self._channel_manager.close()
+        self.save_roster()
+        self.roster_index.clear()
+        self.outbox.cancel()
+        self.message_limiter.cancel()
+        self.invite_limiter.cancel()
+        if self.history is not None:
+            self.history.close()
+        self._advertise_disconnected()
+        
+    def _reconnect_now(self):
+        logger.info("Reconnect attempt %d" % self.reconnector.attempts)
+        try:
+            self.mxit.connect()
+        except Exception, e:
+            # no DISCONNECTED follows a connect that failed outright
+            logger.warning("Reconnect attempt %d failed: %s"
+                    % (self.reconnector.attempts, e))
+            if not self.reconnector.schedule():
+                logger.warning("Giving up after %d reconnect attempts"
+                        % self.reconnector.attempts)
+                self.disconnected(telepathy.CONNECTION_STATUS_REASON_NETWORK_ERROR)
+        
     def _advertise_disconnected(self):
         self._manager.disconnected(self)
            
@@ -25,25 +25,66 @@ import dbus
 import logging
 
 from mixer.connection import MixerConnection
+from mixer.settings import SettingsCache
+from mixer.shard import ShardPool
+from mixer.stats import MixerStats
 
 __all__ = ['MixerConnectionManager']
 
 logger = logging.getLogger('Mixer.ConnectionManager')
 
 
-class MixerConnectionManager(telepathy.server.ConnectionManager):
+class MixerConnectionManager(telepathy.server.ConnectionManager, MixerStats):
     """Mixer connection manager
     
-    Implements the org.freedesktop.Telepathy.ConnectionManager interface"""
+    Implements the org.freedesktop.Telepathy.ConnectionManager interface,
+    and the Stats interface of mixer.stats"""
 
-    def __init__(self, shutdown_func=None):
-        "Initializer"
+    def __init__(self, shutdown_func=None, workers=0, accounts_per_worker=50):
+        """Initializer
+
+        With workers > 0 the connections are run in up to that many worker
+        processes, see mixer.shard."""
         telepathy.server.ConnectionManager.__init__(self, 'mixer')
+        MixerStats.__init__(self)
 
         self._protos['mxit'] = MixerConnection
+        # JAD files are usually shared by many accounts
+        self.settings_cache = SettingsCache()
         self._shutdown = shutdown_func
+        if workers > 0:
+            self._pool = ShardPool(workers, accounts_per_worker, self._shard_disconnected)
+            logger.info("Running connections in up to %d worker processes" % workers)
+        else:
+            self._pool = None
         logger.info("Connection manager created")
 
+    @dbus.service.method(telepathy.CONN_MGR_INTERFACE, in_signature='sa{sv}',
+            out_signature='so', async_callbacks=('_success', '_error'))
+    def RequestConnection(self, proto, parameters, _success, _error):
+        if self._pool is None or proto not in self._protos:
+            try:
+                result = telepathy.server.ConnectionManager.RequestConnection(self,
+                        proto, parameters)
+            except Exception, e:
+                _error(e)
+            else:
+                _success(*result)
+            return
+        self._pool.request(proto, parameters, _success, _error)
+
+    def connection_count(self):
+        """The number of connections, including those in worker processes."""
+        count = len(self._connections)
+        if self._pool is not None:
+            count += self._pool.accounts()
+        return count
+
+    def shard_stats(self):
+        if self._pool is None:
+            return None
+        return self._pool.stats()
+
     def GetParameters(self, proto):
         "Returns the mandatory and optional parameters for the given proto."
         if proto not in self._protos:
@@ -66,22 +107,29 @@ class MixerConnectionManager(telepathy.server.ConnectionManager):
             if parameter_name in default_parameters:
                 param = (parameter_name,
                         telepathy.CONN_MGR_PARAM_FLAG_HAS_DEFAULT,
-                        parameter_name,
+                        parameter_type,
                         default_parameters[parameter_name])
             else:
-                param = (parameter_name, 0, parameter_name, '')
+                param = (parameter_name, 0, parameter_type, '')
             result.append(param)
 
         return result
 
     def disconnected(self, conn):
         logger.info("disconnected")
+        result = telepathy.server.ConnectionManager.disconnected(self, conn)
+        self._schedule_shutdown()
+
+    def _shard_disconnected(self):
+        logger.info("disconnected in worker")
+        self._schedule_shutdown()
+
+    def _schedule_shutdown(self):
         def shutdown():
             if self._shutdown is not None and \
-                    len(self._connections) == 0:
+                    self.connection_count() == 0:
                 self._shutdown()
             return False
-        result = telepathy.server.ConnectionManager.disconnected(self, conn)
         gobject.timeout_add(5000, shutdown)
 
     def quit(self):
@@ -89,4 +137,7 @@ class MixerConnectionManager(telepathy.server.ConnectionManager):
         logger.info("quit")
         for connection in self._connections:
             connection.Disconnect()
+        if self._pool is not None:
+            self._pool.shutdown()
+        self.stop_stats()
         logger.info("Connection manager quitting")
@@ -0,0 +1,116 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import logging
+
+import dbus
+import dbus.service
+
+from mixer.util.batch import SignalBatcher
+
+__all__ = ['MixerContactGroups', 'CONNECTION_INTERFACE_CONTACT_GROUPS']
+
+logger = logging.getLogger('Mixer.ContactGroups')
+
+CONNECTION_INTERFACE_CONTACT_GROUPS = 'org.freedesktop.Telepathy.Connection.Interface.ContactGroups'
+
+# Contact_Metadata_Storage_Type_None: groups are read from the roster and
+# cannot be changed through this interface
+GROUP_STORAGE_NONE = 0
+
+
+class MixerContactGroups(dbus.service.Interface):
+    """Read-only ContactGroups. A MXit buddy is in at most one group.
+
+    move_to_group() and leave_group() report changes with group_changed().
+    The changes are merged into one GroupsChanged per mainloop iteration,
+    preceded by GroupsCreated and followed by GroupsRemoved when the set of
+    groups changed."""
+
+    group_batch_limit = 500
+
+    def __init__(self):
+        self._interfaces.add(CONNECTION_INTERFACE_CONTACT_GROUPS)
+        self._group_batch = SignalBatcher(self._flush_groups,
+                0, self.group_batch_limit)
+        # handle id -> the group last announced for it
+        self._announced_groups = {}
+        self._known_groups = set()
+
+    @property
+    def DisjointGroups(self):
+        return dbus.Boolean(True)
+
+    @property
+    def GroupStorage(self):
+        return dbus.UInt32(GROUP_STORAGE_NONE)
+
+    @property
+    def Groups(self):
+        return dbus.Array(self.roster_index.groups(), signature='s')
+
+    @dbus.service.signal(CONNECTION_INTERFACE_CONTACT_GROUPS, signature='as')
+    def GroupsCreated(self, names):
+        pass
+
+    @dbus.service.signal(CONNECTION_INTERFACE_CONTACT_GROUPS, signature='as')
+    def GroupsRemoved(self, names):
+        pass
+
+    @dbus.service.signal(CONNECTION_INTERFACE_CONTACT_GROUPS, signature='auasas')
+    def GroupsChanged(self, contacts, added, removed):
+        pass
+
+    def group_changed(self, handle, group):
+        """handle is now in group, or in none if group is None."""
+        self._group_batch.add(handle, group)
+
+    def _flush_groups(self, changes):
+        announced = self._announced_groups
+        # (old group, new group) -> handle ids
+        moves = {}
+        for handle, group in changes.iteritems():
+            old = announced.get(handle.id)
+            if old == group:
+                continue
+            if group is None:
+                del announced[handle.id]
+            else:
+                announced[handle.id] = group
+            moves.setdefault((old, group), []).append(handle.id)
+
+        groups = set(self.roster_index.groups())
+        created = groups - self._known_groups
+        removed = self._known_groups - groups
+        self._known_groups = groups
+
+        if created:
+            self.GroupsCreated(list(created))
+        for (old, new), contacts in moves.iteritems():
+            self.GroupsChanged(contacts, _names(new), _names(old))
+        if removed:
+            self.GroupsRemoved(list(removed))
+
+    def group_stats(self):
+        return self._group_batch.stats()
+
+
+def _names(group):
+    if group is None:
+        return []
+    return [group]
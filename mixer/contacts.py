@@ -0,0 +1,124 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import logging
+
+import dbus
+import telepathy
+from telepathy._generated.Connection_Interface_Contacts import ConnectionInterfaceContacts
+
+from mixer.presence import CONNECTION_INTERFACE_SIMPLE_PRESENCE
+from mixer.contactgroups import CONNECTION_INTERFACE_CONTACT_GROUPS
+from mixer.util.decorator import logexceptions
+from mixer.util.instrument import instrumented
+
+__all__ = ['MixerContacts', 'CONNECTION_INTERFACE_CONTACTS']
+
+logger = logging.getLogger('Mixer.Contacts')
+
+CONNECTION_INTERFACE_CONTACTS = 'org.freedesktop.Telepathy.Connection.Interface.Contacts'
+CONNECTION_INTERFACE_ALIASING = 'org.freedesktop.Telepathy.Connection.Interface.Aliasing'
+
+CONTACT_ID = 'org.freedesktop.Telepathy.Connection/contact-id'
+
+# interface -> the attribute it contributes
+ATTRIBUTES = {
+        CONNECTION_INTERFACE_ALIASING: CONNECTION_INTERFACE_ALIASING + '/alias',
+        CONNECTION_INTERFACE_SIMPLE_PRESENCE: CONNECTION_INTERFACE_SIMPLE_PRESENCE + '/presence',
+        CONNECTION_INTERFACE_CONTACT_GROUPS: CONNECTION_INTERFACE_CONTACT_GROUPS + '/groups',
+        }
+
+
+class MixerContacts(ConnectionInterfaceContacts):
+    """Contact attributes for many handles in one call.
+
+    The attributes of a contact are kept as a record of D-Bus values, built
+    on first use and dropped by contact_changed() when the alias, presence
+    or group of the contact changes."""
+
+    def __init__(self):
+        ConnectionInterfaceContacts.__init__(self)
+        # handle id -> {attribute: value}
+        self._contact_records = {}
+        self.record_hits = 0
+        self.record_misses = 0
+
+    @property
+    def ContactAttributeInterfaces(self):
+        return dbus.Array(ATTRIBUTES.keys(), signature='s')
+
+    @dbus.service.method(CONNECTION_INTERFACE_CONTACTS, in_signature='auasb',
+            out_signature='a{ua{sv}}', sender_keyword='sender')
+    def GetContactAttributes(self, handles, interfaces, hold, sender=None):
+        return self._get_contact_attributes(handles, interfaces, hold, sender)
+
+    def contact_changed(self, handle):
+        self._contact_records.pop(handle.id, None)
+
+    def contact_stats(self):
+        return {'records': len(self._contact_records),
+                'hits': self.record_hits,
+                'misses': self.record_misses}
+
+    # dbus.service.method needs the real signature, so the work is done
+    # one level down
+    @instrumented('Contacts.GetContactAttributes')
+    @logexceptions(logger)
+    def _get_contact_attributes(self, handles, interfaces, hold, sender):
+        self.check_connected()
+        wanted = [CONTACT_ID]
+        for interface in interfaces:
+            if interface in ATTRIBUTES:
+                wanted.append(ATTRIBUTES[interface])
+
+        registry = self._handle_registry
+        records = self._contact_records
+        result = {}
+        for handle_id in handles:
+            # unknown handles are left out rather than failing the call
+            handle = registry.get(telepathy.HANDLE_TYPE_CONTACT, handle_id)
+            if handle is None:
+                continue
+            record = records.get(handle_id)
+            if record is None:
+                self.record_misses += 1
+                record = records[handle_id] = self._contact_record(handle)
+            else:
+                self.record_hits += 1
+            if hold:
+                self.add_client_handle(handle, sender)
+            attributes = {}
+            for name in wanted:
+                attributes[name] = record[name]
+            result[handle_id] = attributes
+        return result
+
+    def _contact_record(self, handle):
+        contact = handle.known_contact
+        group = None
+        if contact is not None:
+            group = self.roster_index.group_of(contact.jid)
+        if group is None:
+            groups = []
+        else:
+            groups = [group]
+        return {CONTACT_ID: handle.name,
+                ATTRIBUTES[CONNECTION_INTERFACE_ALIASING]: self.alias_for(handle),
+                ATTRIBUTES[CONNECTION_INTERFACE_SIMPLE_PRESENCE]: self.presence_for(handle),
+                ATTRIBUTES[CONNECTION_INTERFACE_CONTACT_GROUPS]:
+                        dbus.Array(groups, signature='s')}
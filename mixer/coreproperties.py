@@ -3,40 +3,60 @@ import logging
 import dbus
 
 from mixer.util.decorator import async, logexceptions
+from mixer.util.instrument import instrumented
 
 logger = logging.getLogger('Mixer.CoreProperties')
 
 class MixerCoreProperties(dbus.service.Interface):
+    """D-Bus properties backed by attributes.
+
+    GetAll and identifiers() are served from snapshots of the registered
+    attributes. A snapshot is dropped when a registered attribute is
+    assigned, through _set or otherwise, and when properties are registered.
+    Attributes that are class level properties are read on every call.
+    Values must be replaced rather than changed in place, or
+    _invalidate_properties() must be called afterwards."""
     
     def __init__(self):
         dbus.service.Interface.__init__(self)
         self._props = {}
+        self._prop_attrs = set()
+        self._snapshots = {}
+        self._identifiers = None
         self._interfaces.add('org.freedesktop.DBus.Properties')
         
-        
-        
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self.__dict__.get('_prop_attrs', ()):
+            self._invalidate_properties()
     
     @dbus.service.method('org.freedesktop.DBus.Properties', in_signature='s', out_signature='a{sv}')
     def GetAll(self, interface):
-        logger.info("getall %s" % interface)
-        result = {}
-        for name in self._interface(interface):
-            result[name] = self._get(interface, name)
-        #logger.info("%r" % (result))
-        return result
+        logger.debug("getall %s", interface)
+        return self._get_all(interface)
+
+    # dbus.service.method needs the real signature, so the timing is done
+    # one level down
+    @instrumented('Properties.GetAll')
+    def _get_all(self, interface):
+        snapshot = self._snapshots.get(interface)
+        if snapshot is None:
+            snapshot = self._snapshot(self._interface(interface).iteritems(), False)
+            self._snapshots[interface] = snapshot
+        #logger.info("%r" % (snapshot))
+        return self._resolve(snapshot)
             
     @dbus.service.method('org.freedesktop.DBus.Properties', in_signature='ss', out_signature='v')
     def Get(self, interface, name):
-        logger.info("Get %s, %s" % (interface, name))
         r = self._get(interface, name)
-        logger.info("%r" % (r))
+        logger.debug("Get %s, %s: %r", interface, name, r)
         return r
     
     
         
     @dbus.service.method('org.freedesktop.DBus.Properties', in_signature='ssv', out_signature='')
     def Set(self, interface, name, value):
-        logger.info("Set %s|%s=%s" % (interface, name, value))
+        logger.info("Set %s|%s=%s", interface, name, value)
         self._set(interface, name, value)
         
     def get_qualified(self, props):
@@ -68,26 +88,60 @@ class MixerCoreProperties(dbus.service.Interface):
         attr, access = self._interface(interface)[name]
         if 'w' in access:
             setattr(self, attr, value)
+            self._invalidate_properties()
         else:
             #TODO: raise exception
             pass
         
     def _register_rw(self, interface, *props, **properties):
-        for name in props:
-            self._interface(interface)[name] = (name, 'rw')
-        for attr, name in properties.items():
-            self._interface(interface)[name] = (attr, 'rw')
+        self._register(interface, 'rw', props, properties)
     
     def _register_r(self, interface, *props, **properties):
+        self._register(interface, 'r', props, properties)
+    
+    def _register(self, interface, access, props, properties):
         for name in props:
-            self._interface(interface)[name] = (name, 'r')
+            self._interface(interface)[name] = (name, access)
+            self._prop_attrs.add(name)
         for attr, name in properties.items():
-            self._interface(interface)[name] = (attr, 'r')
+            self._interface(interface)[name] = (attr, access)
+            self._prop_attrs.add(attr)
+        self._invalidate_properties()
+    
+    def _invalidate_properties(self):
+        """Drop the cached property snapshots."""
+        self._snapshots = {}
+        self._identifiers = None
             
     def identifiers(self):
-        r = {}
-        for interface, vals in self._props.items():
-            for name, (attr, access) in vals.items():
-                if access == 'r':
-                    r["%s.%s" % (interface, name)] = self._get(interface, name)
-        return r
\ No newline at end of file
+        if self._identifiers is None:
+            props = []
+            for interface, vals in self._props.items():
+                for name, (attr, access) in vals.items():
+                    if access == 'r':
+                        props.append(("%s.%s" % (interface, name), (attr, access)))
+            self._identifiers = self._snapshot(props, True)
+        return self._resolve(self._identifiers)
+    
+    def _snapshot(self, props, signature):
+        static = {}
+        dynamic = []
+        for name, (attr, access) in props:
+            if attr in self.__dict__:
+                static[name] = self.__dict__[attr]
+            else:
+                dynamic.append((name, attr))
+        if signature:
+            static = dbus.Dictionary(static, signature='sv')
+        return (static, dynamic)
+    
+    def _resolve(self, snapshot):
+        static, dynamic = snapshot
+        if not dynamic:
+            return static
+        result = dict(static)
+        for name, attr in dynamic:
+            result[name] = getattr(self, attr)
+        if isinstance(static, dbus.Dictionary):
+            result = dbus.Dictionary(result, signature='sv')
+        return result
\ No newline at end of file
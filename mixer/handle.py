@@ -25,45 +25,83 @@ import exceptions
 
 import telepathy
 
-__all__ = ['MixerHandleFactory']
+__all__ = ['MixerHandleFactory', 'MixerHandleRegistry']
 
 logger = logging.getLogger('Mixer.Handle')
 
 
 def MixerHandleFactory(connection, type, *args):
-    mapping = {'none': MixerNoneHandle,
-               'self': MixerSelfHandle,
-               'contact': MixerContactHandle,
-               'list': MixerListHandle,
-               'group': MixerGroupHandle,
-               'room': MixerRoomHandle}
-    handle = mapping[type](connection, *args)
-    connection._handles[handle.get_type(), handle.get_id()] = handle
-    return handle
+    return _handle_classes[type](connection, *args)
+
+
+class MixerHandleRegistry(object):
+    """Per-connection table of live handles.
+
+    Handles are interned by (class, args) and looked up by (type, id), both
+    in constant time. Handles held by clients through add_client_handle stay
+    alive until every client holding them has released them with
+    ReleaseHandles. Like telepathy's own client handles, a client holds a
+    handle once, however often it asked for it."""
+
+    def __init__(self, handles):
+        self._by_key = weakref.WeakValueDictionary()
+        self._by_id = handles
+        # (type, id) -> (handle, senders holding it)
+        self._holds = {}
+
+    def lookup(self, key):
+        return self._by_key.get(key)
+
+    def register(self, key, handle):
+        self._by_key[key] = handle
+        self._by_id[handle.get_type(), handle.get_id()] = handle
+
+    def get(self, handle_type, handle_id):
+        return self._by_id.get((handle_type, handle_id))
+
+    def hold(self, handle, sender):
+        key = (handle.get_type(), handle.get_id())
+        entry = self._holds.get(key)
+        if entry is None:
+            entry = self._holds[key] = (handle, set())
+        entry[1].add(sender)
+
+    def release(self, handle_type, handle_id, sender):
+        key = (handle_type, handle_id)
+        entry = self._holds.get(key)
+        if entry is None:
+            return
+        entry[1].discard(sender)
+        if not entry[1]:
+            del self._holds[key]
+
+    def held(self, handle_type, handle_id):
+        """The number of clients holding the handle."""
+        entry = self._holds.get((handle_type, handle_id))
+        if entry is None:
+            return 0
+        return len(entry[1])
+
+    def __len__(self):
+        return len(self._by_key)
 
 
 class MixerHandleMeta(type):
     def __call__(cls, connection, *args):
-        obj, newly_created = cls.__new__(cls, connection, *args)
-        if newly_created:
-            obj.__init__(connection, connection.get_handle_id(), *args)
-            #logger.info("New Handle %r" % obj)
-        return obj 
+        registry = connection._handle_registry
+        key = (cls, args)
+        handle = registry.lookup(key)
+        if handle is None:
+            handle = cls.__new__(cls)
+            handle.__init__(connection, connection.get_handle_id(), *args)
+            registry.register(key, handle)
+            #logger.info("New Handle %r" % handle)
+        return handle
 
 
 class MixerHandle(telepathy.server.Handle):
     __metaclass__ = MixerHandleMeta
 
-    instances = weakref.WeakValueDictionary()
-    def __new__(cls, connection, *args):
-        #key = (cls, connection._account[0], args)
-        key = (cls, connection, args)
-        if key not in cls.instances.keys():
-            instance = object.__new__(cls, connection, *args)
-            cls.instances[key] = instance # TRICKY: instances is a weakdict
-            return instance, True
-        return cls.instances[key], False
-
     def __init__(self, connection, id, handle_type, name):
         #HACK
         if handle_type == 0:
@@ -101,6 +139,10 @@ class MixerSelfHandle(MixerHandle):
     @property
     def contact(self):
         return self._conn.mxit.roster.self_buddy
+
+    @property
+    def known_contact(self):
+        return self.contact
     
 
 class MixerNoneHandle(MixerHandle):
@@ -127,6 +169,15 @@ class MixerContactHandle(MixerHandle):
     def contact(self):
         #return self._conn.mxit.roster.get_buddy(self.jid)
         return self._conn.mxit.roster.buddy_or_room(self.jid)
+
+    @property
+    def known_contact(self):
+        """The live contact, or its cached entry while the roster is still
+        being received."""
+        contact = self.contact
+        if contact is None:
+            contact = self._conn.roster_index.get(self.jid)
+        return contact
     
 class MixerRoomHandle(MixerHandle):
     def __init__(self, connection, id, jid):
@@ -161,3 +212,10 @@ class MixerGroupHandle(MixerHandle):
     def group(self):
         return self._conn.mxit.roster.get_group(self.group_name)
 
+
+_handle_classes = {'none': MixerNoneHandle,
+                   'self': MixerSelfHandle,
+                   'contact': MixerContactHandle,
+                   'list': MixerListHandle,
+                   'group': MixerGroupHandle,
+                   'room': MixerRoomHandle}
@@ -0,0 +1,316 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Message history of an account.
+
+The history is a directory of append-only segment files, NNNNNNNN.log.
+Every record is a header (timestamp, direction, length of the jid, length
+of the text) followed by the UTF-8 jid and text. When a segment is full it
+is sealed and its index, the offsets of the records of every jid in time
+order, is written next to it as NNNNNNNN.idx. The index of the segment
+being written is rebuilt from the log when the store is opened.
+
+Records are written by a background thread in batches."""
+
+import os
+import time
+import bisect
+import struct
+import marshal
+import logging
+import threading
+import Queue
+
+__all__ = ['HistoryStore', 'DIRECTION_RECEIVED', 'DIRECTION_SENT']
+
+logger = logging.getLogger('Mixer.History')
+
+DIRECTION_RECEIVED = 0
+DIRECTION_SENT = 1
+
+HEADER = struct.Struct('!dBHI')
+
+_STOP = object()
+
+
+class SegmentIndex(object):
+    """Offsets of the records in one segment, per jid and in time order."""
+
+    def __init__(self, entries=None, first=None, last=None):
+        # jid -> ([timestamps], [offsets])
+        self.entries = entries or {}
+        self.first = first
+        self.last = last
+
+    def add(self, jid, timestamp, offset):
+        entry = self.entries.get(jid)
+        if entry is None:
+            entry = self.entries[jid] = ([], [])
+        timestamps, offsets = entry
+        # clocks may step back; keep the lists sorted
+        if timestamps and timestamp < timestamps[-1]:
+            position = bisect.bisect_right(timestamps, timestamp)
+            timestamps.insert(position, timestamp)
+            offsets.insert(position, offset)
+        else:
+            timestamps.append(timestamp)
+            offsets.append(offset)
+        if self.first is None or timestamp < self.first:
+            self.first = timestamp
+        if self.last is None or timestamp > self.last:
+            self.last = timestamp
+
+    def find(self, jid, start=None, end=None):
+        """Offsets of the records of jid with start <= timestamp <= end."""
+        entry = self.entries.get(jid)
+        if entry is None:
+            return []
+        timestamps, offsets = entry
+        low = 0
+        high = len(timestamps)
+        if start is not None:
+            low = bisect.bisect_left(timestamps, start)
+        if end is not None:
+            high = bisect.bisect_right(timestamps, end)
+        return offsets[low:high]
+
+    def dump(self):
+        return marshal.dumps((self.entries, self.first, self.last))
+
+    @classmethod
+    def load(cls, data):
+        entries, first, last = marshal.loads(data)
+        return cls(entries, first, last)
+
+
+class HistoryStore(object):
+    """The history of one account, see the module documentation."""
+
+    def __init__(self, directory, segment_size=4 * 1024 * 1024, batch_size=256):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._segments = []
+        self._queue = Queue.Queue()
+        self._file = None
+        self.written = 0
+        self.batches = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._open()
+        self._thread = threading.Thread(target=self._run, name='history-writer')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def record(self, direction, jid, text, timestamp=None):
+        """Queue a message for writing; returns at once. Ignored once the
+        history is closed."""
+        if self._thread is None:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        self._queue.put((timestamp, direction, jid, text))
+
+    def last(self, jid, count):
+        """The last count messages with jid, oldest first."""
+        return self.query(jid, count=count)
+
+    def query(self, jid, start=None, end=None, count=None):
+        """Messages with jid as (timestamp, direction, text) tuples, oldest
+        first. With count only the newest count matches are returned."""
+        if count is not None and count <= 0:
+            return []
+        if isinstance(jid, unicode):
+            jid = jid.encode('utf-8')
+        offsets = []
+        remaining = count
+        self._lock.acquire()
+        try:
+            for segment in reversed(self._segments):
+                index = self._indexes[segment]
+                if start is not None and index.last is not None and index.last < start:
+                    break
+                if end is not None and index.first is not None and index.first > end:
+                    continue
+                found = index.find(jid, start, end)
+                if remaining is not None:
+                    found = found[-remaining:]
+                    remaining -= len(found)
+                offsets.append((segment, found))
+                if remaining == 0:
+                    break
+        finally:
+            self._lock.release()
+
+        result = []
+        for segment, found in reversed(offsets):
+            if not found:
+                continue
+            file = open(self._path(segment, 'log'), 'rb')
+            try:
+                for offset in found:
+                    timestamp, direction, record_jid, text = self._read(file, offset)
+                    result.append((timestamp, direction, text))
+            finally:
+                file.close()
+        return result
+
+    def close(self):
+        """Write the queued messages and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {'segments': len(self._segments),
+                'written': self.written,
+                'batches': self.batches,
+                'queued': self._queue.qsize()}
+
+    # Writer thread
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            stop = _STOP in batch
+            records = [item for item in batch if item is not _STOP]
+            try:
+                self._write(records)
+            except (IOError, OSError), e:
+                logger.error("Could not write history: %s" % e)
+            if stop:
+                self._file.close()
+                return
+
+    def _write(self, records):
+        if not records:
+            return
+        added = []
+        for timestamp, direction, jid, text in records:
+            if isinstance(jid, unicode):
+                jid = jid.encode('utf-8')
+            if isinstance(text, unicode):
+                text = text.encode('utf-8')
+            offset = self._file.tell()
+            self._file.write(HEADER.pack(timestamp, direction, len(jid), len(text)))
+            self._file.write(jid)
+            self._file.write(text)
+            added.append((jid, timestamp, offset))
+        self._file.flush()
+
+        # the records are readable now, publish them in the index
+        self._lock.acquire()
+        try:
+            index = self._indexes[self._segments[-1]]
+            for jid, timestamp, offset in added:
+                index.add(jid, timestamp, offset)
+        finally:
+            self._lock.release()
+        self.written += len(records)
+        self.batches += 1
+
+        if self._file.tell() >= self.segment_size:
+            self._seal()
+
+    def _seal(self):
+        segment = self._segments[-1]
+        self._file.close()
+        index = self._indexes[segment]
+        file = open(self._path(segment, 'idx'), 'wb')
+        try:
+            file.write(index.dump())
+        finally:
+            file.close()
+        self._lock.acquire()
+        try:
+            self._segments.append(segment + 1)
+            self._indexes[segment + 1] = SegmentIndex()
+        finally:
+            self._lock.release()
+        self._file = open(self._path(segment + 1, 'log'), 'ab')
+
+    # Opening
+
+    def _open(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            base, extension = os.path.splitext(name)
+            if extension == '.log' and base.isdigit():
+                segments.append(int(base))
+        segments.sort()
+        if not segments:
+            segments = [0]
+
+        for segment in segments[:-1]:
+            try:
+                file = open(self._path(segment, 'idx'), 'rb')
+                try:
+                    self._indexes[segment] = SegmentIndex.load(file.read())
+                finally:
+                    file.close()
+            except (IOError, EOFError, ValueError, TypeError):
+                logger.warning("Rebuilding index of history segment %d" % segment)
+                self._indexes[segment] = self._scan(segment)
+        active = segments[-1]
+        self._indexes[active] = self._scan(active)
+        self._segments = segments
+        self._file = open(self._path(active, 'log'), 'ab')
+
+    def _scan(self, segment):
+        index = SegmentIndex()
+        path = self._path(segment, 'log')
+        if not os.path.exists(path):
+            return index
+        file = open(path, 'r+b')
+        try:
+            offset = 0
+            while True:
+                header = file.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                timestamp, direction, jid_length, text_length = HEADER.unpack(header)
+                jid = file.read(jid_length)
+                if len(jid) < jid_length or \
+                        len(file.read(text_length)) < text_length:
+                    break
+                index.add(jid, timestamp, offset)
+                offset = file.tell()
+            # drop a record that was cut off
+            file.truncate(offset)
+        finally:
+            file.close()
+        return index
+
+    def _read(self, file, offset):
+        file.seek(offset)
+        timestamp, direction, jid_length, text_length = HEADER.unpack(file.read(HEADER.size))
+        jid = file.read(jid_length)
+        text = file.read(text_length).decode('utf-8', 'replace')
+        return timestamp, direction, jid, text
+
+    def _path(self, segment, extension):
+        return os.path.join(self.directory, '%08d.%s' % (segment, extension))
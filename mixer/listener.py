@@ -38,7 +38,10 @@ from mixer.channel.contact_list import MixerListChannel
 from mixer.channel.group import MixerGroupChannel
 from mixer.channel.multitext import MixerRoomChannel
 from mixer.channel_manager import ChannelManager
+from mixer.spool import SpoolFull
+from mixer.history import DIRECTION_RECEIVED, DIRECTION_SENT
 from mixer.util.decorator import async, logexceptions
+from mixer.util.instrument import instrument_methods
 
 __all__ = ['MixerListener']
 
@@ -53,6 +56,7 @@ class MixerListener:
         if sender.is_room():
             logger.info("Ignoring room message: %s" % message)
         else:
+            self.con.log_message(DIRECTION_RECEIVED, sender, message.message)
             channel = self.con.get_buddy_channel(sender)
             channel.message_received(message)
         
@@ -63,11 +67,12 @@ class MixerListener:
         msg = "<%s> %s" % (message.buddy.name, message.message)
         message.message = msg
         message.buddy = room
+        self.con.log_message(DIRECTION_RECEIVED, room, msg)
         channel.message_received(message)
     
     def room_buddies_joined(self, room, buddies):
         names = [buddy.name for buddy in buddies]
-        logger.info("These buddies joined: %s" % names)
+        logger.debug("These buddies joined: %s", names)
         channel = self.con.get_room_channel(room)
         if len(names) == 1:
             msg = "%s has joined" % (','.join(names))
@@ -79,7 +84,7 @@ class MixerListener:
         
     def room_buddies_left(self, room, buddies):
         names = [buddy.name for buddy in buddies]
-        logger.info("These buddies left: %s" % names)
+        logger.debug("These buddies left: %s", names)
         channel = self.con.get_room_channel(room)
         if len(names) == 1:
             msg = "%s has left" % (','.join(names))
@@ -120,6 +125,7 @@ class MixerListener:
         self.con.notify_error(response.message)
     
     def message_sent(self, message):
+        outgoing = self.con.outbox.acked(message)
         recipient = message.buddy
         if recipient.type == BuddyType.ROOM:
             channel = self.con.get_room_channel(recipient)
@@ -129,17 +135,26 @@ class MixerListener:
             #handle = MixerHandleFactory(self.con, 'contact', recipient.jid)
             #channel = self.con._channel_manager.channel_for_text(handle)
             
-        channel.Sent(int(time.time()), telepathy.CHANNEL_TEXT_MESSAGE_TYPE_NORMAL, message.message)
+        if outgoing is not None:
+            timestamp = outgoing.submitted
+        else:
+            timestamp = time.time()
+        self.con.log_message(DIRECTION_SENT, recipient, message.message, timestamp)
+        channel.Sent(int(timestamp), telepathy.CHANNEL_TEXT_MESSAGE_TYPE_NORMAL, message.message)
         
     
     def message_error(self, message, error="Message cannot be delivered"):        
+        outgoing = self.con.outbox.failed(message)
         recipient = message.buddy
         if recipient.type == BuddyType.ROOM:
             channel = self.con.get_room_channel(recipient)
         else:
             channel = self.con.get_buddy_channel(recipient)
         
-        ts = int(time.time())
+        if outgoing is not None:
+            ts = int(outgoing.submitted)
+        else:
+            ts = int(time.time())
         channel.SendError(ts, telepathy.CHANNEL_TEXT_SEND_ERROR_UNKNOWN, telepathy.CHANNEL_TEXT_MESSAGE_TYPE_NORMAL, message.message)
         
         
@@ -151,6 +166,7 @@ class MixerListener:
     
     def buddy_updated(self, buddy, **attrs):
         #logger.info("Buddy updated: %r" % (attrs))
+        self.con.roster_index.update(buddy)
         if 'presence' in attrs:
             self.con.presence_received(buddy)
             for channel in map(self.con.get_list_channel, ['subscribe', 'publish']):
@@ -161,32 +177,41 @@ class MixerListener:
         if 'name' in attrs:
             self.con._contact_alias_changed(buddy)
         if 'group' in attrs:
-            self._add_to_group(buddy)
+            self.con.move_to_group(buddy)
     
     def profile_updated(self, profile, **attrs):
-        logger.info("Profile updated: %r" % (attrs))
+        logger.info("Profile updated: %r", attrs)
         
         if 'name' in attrs:
             self.con._contact_alias_changed(profile)
             
         #if 'group' in attrs:
-        #    self._add_to_group(buddy)
+        #    self.con.move_to_group(buddy)
             
     def buddy_added(self, buddy):
         #logger.info("Buddy added|%s" % buddy)
+        cached = self.con.roster_cache.confirm(buddy)
+        self.con.roster_index.update(buddy)
+        self.con.forget_presence(buddy)
+        if cached is not None:
+            self._reconcile(cached, buddy)
+            return
+        
         for channel in map(self.con.get_list_channel, ['subscribe', 'publish']):
             channel.buddy_added(buddy)
             
-        self._add_to_group(buddy)
+        self.con.move_to_group(buddy)
         self.con._contact_alias_changed(buddy)
     
     def room_removed(self, room):
         self.buddy_removed(room)
           
     def buddy_removed(self, buddy):
-        for handle, channel in self.con._channel_manager._list_channels.items():
-            if isinstance(channel, MixerListChannel):
-                channel.buddy_removed(buddy)
+        self.con.roster_index.remove(buddy)
+        self.con.forget_presence(buddy)
+        for channel in map(self.con.get_list_channel, ['subscribe', 'publish']):
+            channel.buddy_removed(buddy)
+        self.con.leave_group(buddy)
         
         
     def status_changed(self, status, reason):
@@ -200,16 +225,17 @@ class MixerListener:
         }
         tel_reason = reason_map[reason]
         if status == Status.CONNECTING:
-            self.con.StatusChanged(telepathy.CONNECTION_STATUS_CONNECTING, tel_reason)
+            # clients keep seeing CONNECTED while we reconnect
+            if not self.con.reconnecting:
+                self.con.StatusChanged(telepathy.CONNECTION_STATUS_CONNECTING, tel_reason)
         elif status == Status.AUTHENTICATING:
             pass
         elif status == Status.ACTIVE:
-            self.con.StatusChanged(telepathy.CONNECTION_STATUS_CONNECTED, tel_reason)
-            self.con.init_channels()
+            self.con.connected(tel_reason)
         elif status == Status.DISCONNECTED:
-            self.con.StatusChanged(telepathy.CONNECTION_STATUS_DISCONNECTED, tel_reason)
-            self.con._channel_manager.close()
-            self.con._advertise_disconnected()
+            self.con.flush_signals()
+            if not self.con.reconnect(reason):
+                self.con.disconnected(tel_reason)
                 
         
     def file_pending(self, descriptor, buddy):
@@ -217,22 +243,34 @@ class MixerListener:
         self.con.mxit.request_file(descriptor)
         
     def file_received(self, descriptor, data):
-        self.con.get_file_channel(descriptor)
         logger.info("data received for %s" % (descriptor.name))
+        try:
+            spool_file = self.con.transfer_spool.create(len(data))
+        except SpoolFull, e:
+            logger.warning("Dropping file %s: %s" % (descriptor.name, e))
+            self.con.notify_error("Could not receive file %s: %s" % (descriptor.name, e))
+            return
+        spool_file.write(data)
+        channel = self.con.get_file_channel(descriptor)
+        channel.offer(spool_file)
         
     def error(self, message, exception):
         import traceback
         logger.error("Random exception occured: %s | %s" % (message, traceback.format_exc()))
         
         
-    def _add_to_group(self, buddy):
-        channel = self.con.group_for_buddy(buddy)
-        buddy_handle = self.con.handle_for_buddy(buddy)
-        
-        for ch in self.con.get_group_channels():
-            if ch != channel:
-                ch.buddy_removed(buddy)
-                
-        if channel is not None:
-            #channel.add_contacts([buddy_handle])
-            channel.buddy_added(buddy)
\ No newline at end of file
+    def _reconcile(self, cached, buddy):
+        # the channels already show the cached entry, only signal the differences
+        changed = self.con.roster_cache.changes(cached, buddy)
+        if 'subscription' in changed:
+            for channel in map(self.con.get_list_channel, ['subscribe', 'publish']):
+                channel.check_buddy(buddy)
+        if 'group' in changed:
+            self.con.move_to_group(buddy)
+        if 'name' in changed:
+            self.con._contact_alias_changed(buddy)
+        if 'presence' in changed:
+            self.con.presence_received(buddy)
+
+
+instrument_methods(MixerListener, 'Listener')
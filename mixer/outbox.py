@@ -0,0 +1,283 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Queue of outgoing messages"""
+
+import time
+import logging
+import exceptions
+import collections
+
+import gobject
+
+__all__ = ['MessageQueue', 'OutgoingMessage', 'QueueFull']
+
+logger = logging.getLogger('Mixer.Outbox')
+
+
+class QueueFull(exceptions.Exception):
+    pass
+
+
+class OutgoingMessage(object):
+    __slots__ = ['token', 'buddy', 'text', 'submitted', 'sent']
+
+    def __init__(self, token, buddy, text):
+        self.token = token
+        self.buddy = buddy
+        self.text = text
+        self.submitted = time.time()
+        self.sent = None
+
+    def __repr__(self):
+        return "<OutgoingMessage %d to %s>" % (self.token, self.buddy.jid)
+
+
+class MessageQueue(object):
+    """Outgoing messages, from Send until the server acknowledges them.
+
+    submit() only queues the message. At most window messages are in the
+    pipeline at once, i.e. handed to the limiter or sent and not yet
+    acknowledged, and per recipient only one message waits in the limiter at
+    a time so that a slow recipient does not hold up the others. Messages
+    that are not acknowledged within ack_timeout milliseconds, or that
+    could not be handed to transmit at all, are given up and passed to
+    expired(message). Acknowledgements are matched to messages by
+    recipient and text; one that matches nothing in flight is not ours."""
+
+    def __init__(self, transmit, limiter, expired, window=16, max_queue=1000,
+            ack_timeout=60000, samples=1000):
+        self._transmit = transmit
+        self._limiter = limiter
+        self._expired = expired
+        self.window = window
+        self.max_queue = max_queue
+        self.ack_timeout = ack_timeout
+
+        self._queues = {}
+        self._ready = collections.deque()
+        self._limited = {}
+        self._in_flight = {}
+        self._in_flight_count = 0
+        self._queued_count = 0
+        self._next_token = 0
+        self._held = False
+        self._pumping = False
+        self._expire_source = None
+
+        self._latencies = collections.deque(maxlen=samples)
+        self.submitted = 0
+        self.delivered = 0
+        self.failures = 0
+        self.timeouts = 0
+
+    def submit(self, buddy, text):
+        """Queue a message and return its token, or raise QueueFull."""
+        if self.max_queue and self._queued_count >= self.max_queue:
+            raise QueueFull("%d messages already queued" % self._queued_count)
+        self._next_token += 1
+        message = OutgoingMessage(self._next_token, buddy, text)
+        self.submitted += 1
+        self._enqueue(message)
+        self._pump()
+        return message.token
+
+    def acked(self, mxit_message):
+        """The server acknowledged mxit_message. Returns the matching
+        OutgoingMessage, or None if it was not sent through the queue."""
+        message = self._complete(mxit_message)
+        if message is not None:
+            self.delivered += 1
+            self._latencies.append(time.time() - message.submitted)
+        return message
+
+    def failed(self, mxit_message):
+        """The server refused mxit_message. Returns the matching
+        OutgoingMessage, or None."""
+        message = self._complete(mxit_message)
+        if message is not None:
+            self.failures += 1
+        return message
+
+    def hold(self):
+        """Stop sending, e.g. while reconnecting. Messages waiting in the
+        limiter go back to the front of their queue; messages on the wire are
+        given up. Returns the given up messages."""
+        self._held = True
+        for jid, message in self._limited.items():
+            self._queues.setdefault(jid, collections.deque()).appendleft(message)
+            self._queued_count += 1
+            self._in_flight_count -= 1
+        self._limited = {}
+
+        lost = []
+        for messages in self._in_flight.values():
+            lost.extend(messages)
+        self._in_flight = {}
+        self._in_flight_count = 0
+        self.failures += len(lost)
+        self._stop_expiry()
+
+        self._ready = collections.deque([jid for jid, queue in self._queues.items() if queue])
+        return lost
+
+    def resume(self):
+        self._held = False
+        self._pump()
+
+    def cancel(self):
+        """Drop everything."""
+        self._queues = {}
+        self._ready.clear()
+        self._limited = {}
+        self._in_flight = {}
+        self._in_flight_count = 0
+        self._queued_count = 0
+        self._stop_expiry()
+
+    def queued(self):
+        return self._queued_count
+
+    def in_flight(self):
+        return self._in_flight_count
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return latencies[int(fraction * (len(latencies) - 1))]
+        return {'submitted': self.submitted,
+                'delivered': self.delivered,
+                'failed': self.failures,
+                'expired': self.timeouts,
+                'queued': self._queued_count,
+                'in_flight': self._in_flight_count,
+                'latency_p50': percentile(0.5),
+                'latency_p90': percentile(0.9),
+                'latency_p99': percentile(0.99),
+                'latency_max': percentile(1.0)}
+
+    def _enqueue(self, message):
+        jid = message.buddy.jid
+        queue = self._queues.get(jid)
+        if queue is None:
+            queue = self._queues[jid] = collections.deque()
+        queue.append(message)
+        self._queued_count += 1
+        if len(queue) == 1 and jid not in self._limited:
+            self._ready.append(jid)
+
+    def _pump(self):
+        if self._pumping or self._held:
+            return
+        self._pumping = True
+        try:
+            while self._ready and self._in_flight_count < self.window:
+                jid = self._ready.popleft()
+                queue = self._queues.get(jid)
+                if not queue or jid in self._limited:
+                    continue
+                message = queue.popleft()
+                if not queue:
+                    del self._queues[jid]
+                self._queued_count -= 1
+                self._in_flight_count += 1
+                self._limited[jid] = message
+                self._limiter.submit(jid, self._send, message)
+        finally:
+            self._pumping = False
+
+    def _send(self, message):
+        jid = message.buddy.jid
+        if self._limited.get(jid) is not message:
+            # dropped by hold() or cancel() in the meantime
+            return
+        del self._limited[jid]
+        message.sent = time.time()
+        self._in_flight.setdefault(jid, collections.deque()).append(message)
+        self._start_expiry()
+        if jid in self._queues:
+            self._ready.append(jid)
+        try:
+            self._transmit(message.buddy, message.text)
+        except Exception, e:
+            # nothing will acknowledge it, give it up now rather than
+            # after ack_timeout
+            logger.warning("Could not send %r: %s" % (message, e))
+            self._forget(message)
+            self.failures += 1
+            self._expired(message)
+        self._pump()
+
+    def _complete(self, mxit_message):
+        in_flight = self._in_flight.get(mxit_message.buddy.jid)
+        if not in_flight:
+            return None
+        # PyMXit does not say which message an ack is for, only the text
+        # tells. Acks for one recipient arrive in order, so of several
+        # messages with the same text the oldest is the one.
+        text = _text(mxit_message.message)
+        for message in in_flight:
+            if _text(message.text) == text:
+                self._forget(message)
+                self._pump()
+                return message
+        # not sent through the queue
+        return None
+
+    def _forget(self, message):
+        jid = message.buddy.jid
+        in_flight = self._in_flight[jid]
+        in_flight.remove(message)
+        if not in_flight:
+            del self._in_flight[jid]
+        self._in_flight_count -= 1
+
+    def _start_expiry(self):
+        if self._expire_source is None and self.ack_timeout:
+            self._expire_source = gobject.timeout_add(self.ack_timeout / 2, self._expire)
+
+    def _stop_expiry(self):
+        if self._expire_source is not None:
+            gobject.source_remove(self._expire_source)
+            self._expire_source = None
+
+    def _expire(self):
+        deadline = time.time() - self.ack_timeout / 1000.0
+        expired = []
+        for jid, in_flight in self._in_flight.items():
+            while in_flight and in_flight[0].sent < deadline:
+                expired.append(in_flight.popleft())
+            if not in_flight:
+                del self._in_flight[jid]
+        self._in_flight_count -= len(expired)
+        self.timeouts += len(expired)
+        if not self._in_flight:
+            self._expire_source = None
+        for message in expired:
+            logger.warning("No acknowledgement for %r" % message)
+            self._expired(message)
+        self._pump()
+        return self._expire_source is not None
+
+
+def _text(text):
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
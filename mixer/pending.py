@@ -0,0 +1,189 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Pending (unacknowledged) messages of text channels"""
+
+import logging
+import collections
+
+import telepathy
+
+from mixer.util.decorator import logexceptions
+
+__all__ = ['PendingMessageStore', 'MixerPendingMessages',
+        'SPILL_DROP_OLDEST', 'SPILL_DROP_NEWEST']
+
+logger = logging.getLogger('Mixer.Pending')
+
+# What happens to a message that does not fit any more:
+# the oldest pending messages are dropped to make room
+SPILL_DROP_OLDEST = 'drop-oldest'
+# the new message is not kept (it is still signalled)
+SPILL_DROP_NEWEST = 'drop-newest'
+
+# Rough per-message overhead, added to the length of the text
+MESSAGE_OVERHEAD = 64
+
+
+class PendingMessageStore(object):
+    """Messages received on a channel and not yet acknowledged, by id.
+
+    It stands in for the _pending_messages dict of
+    telepathy.server.ChannelTypeText, so the Received signal stores into it.
+    Messages are kept in arrival order; acknowledging leaves a gap in the
+    order that is skipped, and squeezed out once there are more gaps than
+    messages. At most max_count messages and max_bytes of text are kept."""
+
+    def __init__(self, max_count=1000, max_bytes=1024 * 1024,
+            spill=SPILL_DROP_OLDEST, spilled=None):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self._spilled = spilled
+        self._messages = {}
+        self._order = collections.deque()
+        self._gaps = 0
+        self._next_id = 0
+        self.bytes = 0
+        self.dropped = 0
+
+    def next_id(self):
+        id = self._next_id
+        self._next_id = (id + 1) & 0xffffffff
+        return id
+
+    def __setitem__(self, id, message):
+        if id in self._messages:
+            self._remove(id)
+        size = self._size(message)
+        if self._full(size):
+            if self.spill == SPILL_DROP_NEWEST:
+                self._drop(id, message)
+                return
+            while self._messages and self._full(size):
+                oldest = self._oldest()
+                self._drop(oldest, self._remove(oldest))
+        self._messages[id] = message
+        self._order.append(id)
+        self.bytes += size
+
+    def __getitem__(self, id):
+        return self._messages[id]
+
+    def __delitem__(self, id):
+        if id not in self._messages:
+            raise KeyError(id)
+        self._remove(id)
+
+    def __contains__(self, id):
+        return id in self._messages
+
+    def __len__(self):
+        return len(self._messages)
+
+    def keys(self):
+        return [id for id in self._order if id in self._messages]
+
+    def list(self, clear=False):
+        """The pending messages as (id, timestamp, sender, type, flags, text)
+        tuples, oldest first."""
+        messages = self._messages
+        result = [(id,) + messages[id] for id in self._order if id in messages]
+        if clear:
+            self.clear()
+        return result
+
+    def acknowledge(self, ids):
+        """Remove the given messages. Nothing is removed if one of them is not
+        pending; the unknown ids are returned instead."""
+        missing = [id for id in ids if id not in self._messages]
+        if not missing:
+            for id in ids:
+                if id in self._messages:
+                    self._remove(id)
+        return missing
+
+    def clear(self):
+        self._messages = {}
+        self._order.clear()
+        self._gaps = 0
+        self.bytes = 0
+
+    def stats(self):
+        return {'pending': len(self._messages),
+                'bytes': self.bytes,
+                'dropped': self.dropped}
+
+    def _size(self, message):
+        return len(message[-1]) + MESSAGE_OVERHEAD
+
+    def _full(self, size):
+        return (self.max_count and len(self._messages) >= self.max_count) or \
+                (self.max_bytes and self.bytes + size > self.max_bytes)
+
+    def _oldest(self):
+        while True:
+            id = self._order.popleft()
+            if id in self._messages:
+                self._order.appendleft(id)
+                return id
+            self._gaps -= 1
+
+    def _remove(self, id):
+        message = self._messages.pop(id)
+        self.bytes -= self._size(message)
+        self._gaps += 1
+        if self._gaps > 64 and self._gaps > len(self._messages):
+            self._order = collections.deque([id for id in self._order
+                    if id in self._messages])
+            self._gaps = 0
+        return message
+
+    def _drop(self, id, message):
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 100 == 0:
+            logger.warning("Pending message store full, %d messages dropped" % self.dropped)
+        if self._spilled is not None:
+            self._spilled(id, message)
+
+
+class MixerPendingMessages(object):
+    """Mixin for text channels that keeps the pending messages in a
+    PendingMessageStore. It has to come before
+    telepathy.server.ChannelTypeText in the bases, and be initialised
+    after it."""
+
+    pending_max_count = 1000
+    pending_max_bytes = 1024 * 1024
+
+    def __init__(self):
+        self._pending_messages = PendingMessageStore(self.pending_max_count,
+                self.pending_max_bytes)
+
+    def next_message_id(self):
+        return self._pending_messages.next_id()
+
+    @logexceptions(logger)
+    def ListPendingMessages(self, clear):
+        return self._pending_messages.list(clear)
+
+    @logexceptions(logger)
+    def AcknowledgePendingMessages(self, ids):
+        missing = self._pending_messages.acknowledge(ids)
+        if missing:
+            raise telepathy.InvalidArgument("Unknown pending message ids: %r" % (missing,))
@@ -23,17 +23,23 @@ import logging
 import time
 import exceptions
 
+import dbus
 import telepathy
+from telepathy._generated.Connection_Interface_Simple_Presence import ConnectionInterfaceSimplePresence
 
 from mxit.handles import Presence, Mood
 
 from mixer.handle import MixerHandleFactory
 from mixer.util.decorator import async, logexceptions
+from mixer.util.instrument import instrumented
+from mixer.util.batch import SignalBatcher
 
-__all__ = ['MixerPresence']
+__all__ = ['MixerPresence', 'MixerPresenceMapping', 'CONNECTION_INTERFACE_SIMPLE_PRESENCE']
 
 logger = logging.getLogger('Mixer.Presence')
 
+CONNECTION_INTERFACE_SIMPLE_PRESENCE = 'org.freedesktop.Telepathy.Connection.Interface.SimplePresence'
+
 class MixerPresenceMapping(object):
     AVAILABLE = 'available'
     AWAY = 'away'
@@ -66,6 +72,16 @@ class MixerPresenceMapping(object):
             UNKNOWN: Presence.PENDING,
             }
 
+    # status -> Connection_Presence_Type
+    types = {
+            AVAILABLE: telepathy.CONNECTION_PRESENCE_TYPE_AVAILABLE,
+            AWAY: telepathy.CONNECTION_PRESENCE_TYPE_AWAY,
+            BUSY: telepathy.CONNECTION_PRESENCE_TYPE_BUSY,
+            XA: telepathy.CONNECTION_PRESENCE_TYPE_EXTENDED_AWAY,
+            OFFLINE: telepathy.CONNECTION_PRESENCE_TYPE_OFFLINE,
+            UNKNOWN: 7,     #telepathy.CONNECTION_PRESENCE_TYPE_UNKNOWN
+            }
+
     to_telepathy = {
             Presence.AVAILABLE: AVAILABLE,
             Presence.AWAY: AWAY,
@@ -78,10 +94,28 @@ class MixerPresenceMapping(object):
             }
 
 
-class MixerPresence(telepathy.server.ConnectionInterfacePresence):
+class MixerPresence(telepathy.server.ConnectionInterfacePresence,
+        ConnectionInterfaceSimplePresence):
+    """The Presence and SimplePresence interfaces.
+
+    The presence of every contact is kept as an immutable
+    (type, status, message) tuple, computed on first use and replaced when
+    the listener reports a presence or mood change. Both interfaces are
+    answered from these tuples."""
+
+    # Presence changes are collected for this many milliseconds, or until
+    # this many handles changed, and then emitted as one PresenceUpdate
+    # and one PresencesChanged.
+    presence_flush_interval = 100
+    presence_batch_limit = 500
 
     def __init__(self):
         telepathy.server.ConnectionInterfacePresence.__init__(self)
+        ConnectionInterfaceSimplePresence.__init__(self)
+        # handle id -> (type, status, message)
+        self._presences = {}
+        self._presence_batch = SignalBatcher(self._flush_presences,
+                self.presence_flush_interval, self.presence_batch_limit)
         
 
     @logexceptions(logger)
@@ -118,15 +152,43 @@ class MixerPresence(telepathy.server.ConnectionInterfacePresence):
         presences = self.get_presences(contacts)
         self.PresenceUpdate(presences)
 
+    @instrumented('Presence.GetPresence')
     @logexceptions(logger)
     def GetPresence(self, contacts):
         return self.get_presences(contacts)
 
+    @property
+    def Statuses(self):
+        # status -> (type, may set on self, can have message)
+        statuses = {}
+        for status, (type, may_set, exclusive, arguments) in self.GetStatuses().iteritems():
+            may_set = may_set and status != MixerPresenceMapping.UNKNOWN
+            statuses[status] = (dbus.UInt32(type), may_set, False)
+        return dbus.Dictionary(statuses, signature='s(ubb)')
+
+    @instrumented('SimplePresence.GetPresences')
+    @logexceptions(logger)
+    def GetPresences(self, contacts):
+        presences = {}
+        for handle_id in contacts:
+            handle = self.handle(telepathy.HANDLE_TYPE_CONTACT, handle_id)
+            presences[handle_id] = self.presence_for(handle)
+        return presences
+
+    @logexceptions(logger)
+    def SetPresence(self, status, message):
+        may_set = self.Statuses.get(status, (0, False, False))[1]
+        if not may_set:
+            raise telepathy.InvalidArgument("Status %s cannot be set" % status)
+        # MXit has no status messages
+        self.SetStatus({status: {}})
+
     @logexceptions(logger)
     def SetStatus(self, statuses):
         status, arguments = statuses.items()[0]
         if status == MixerPresenceMapping.OFFLINE:
             self.Disconnect()
+            return
 
         presence = MixerPresenceMapping.to_mxit[status]
         #message = arguments.get('message', u'').encode("utf-8")
@@ -140,34 +202,63 @@ class MixerPresence(telepathy.server.ConnectionInterfacePresence):
         presences = {}
         for handle_id in contacts:
             handle = self.handle(telepathy.HANDLE_TYPE_CONTACT, handle_id)
-            
-            contact = handle.contact
-            presences[handle] = (0, self._get_presence(contact))
-                
+            presences[handle] = (0, self._presence_arguments(self.presence_for(handle)))
         return presences
 
+    def presence_for(self, handle):
+        """The (type, status, message) tuple of the contact of handle."""
+        presence = self._presences.get(handle.id)
+        if presence is None:
+            presence = self._compute_presence(handle.known_contact)
+            self._presences[handle.id] = presence
+        return presence
+
     def presence_received(self, buddy):
         handle = self.handle_for_buddy(buddy)
         self._presence_changed(handle)
+
+    def forget_presence(self, buddy):
+        """Drop the presence kept for buddy without signalling it, e.g. when
+        it joins or leaves the roster."""
+        handle = self.handle_for_buddy(buddy)
+        self._presences.pop(handle.id, None)
+        self.contact_changed(handle)
         
-    def _get_presence(self, buddy):
+    def _compute_presence(self, buddy):
         if buddy:
-            mood = buddy.mood
-            presence = MixerPresenceMapping.to_telepathy[buddy.presence]
-            
-            arguments = {}
+            status = MixerPresenceMapping.to_telepathy[buddy.presence]
             if buddy.is_room():
-                arguments = {'message' : 'MultiMX'}
+                message = u'MultiMX'
+            elif buddy.mood != Mood.NONE:
+                message = buddy.mood.text
             else:
-                if mood != Mood.NONE:
-                    arguments = {'message' : mood.text}
-            
-            return {presence : arguments}
+                message = u''
         else:
-            return {MixerPresenceMapping.OFFLINE : {}}
-        
-    @async
+            status = MixerPresenceMapping.OFFLINE
+            message = u''
+        return dbus.Struct((dbus.UInt32(MixerPresenceMapping.types[status]),
+                status, message), signature='uss')
+
+    def _presence_arguments(self, presence):
+        type, status, message = presence
+        if message:
+            return {status: {'message': message}}
+        return {status: {}}
+
     def _presence_changed(self, handle):
-        buddy = handle.contact
-        
-        self.PresenceUpdate({handle: (int(time.time()), self._get_presence(buddy))})
+        self._presences[handle.id] = self._compute_presence(handle.known_contact)
+        self.contact_changed(handle)
+        self._presence_batch.add(handle, int(time.time()))
+
+    def _flush_presences(self, changes):
+        presences = {}
+        simple_presences = {}
+        for handle, timestamp in changes.iteritems():
+            presence = self.presence_for(handle)
+            presences[handle] = (timestamp, self._presence_arguments(presence))
+            simple_presences[handle.id] = presence
+        self.PresenceUpdate(presences)
+        self.PresencesChanged(simple_presences)
+
+    def presence_stats(self):
+        return self._presence_batch.stats()
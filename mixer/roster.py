@@ -0,0 +1,114 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import logging
+
+from mxit.handles import Presence
+
+__all__ = ['MixerRosterIndex']
+
+logger = logging.getLogger('Mixer.Roster')
+
+
+class MixerRosterIndex(object):
+    """Membership of the contact lists, kept up to date incrementally.
+
+    The index is fed by the MixerListener roster callbacks, so the list and
+    group channels can find their members in time proportional to the answer
+    instead of scanning the whole roster."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._contacts = {}
+        self._subscribed = {}
+        self._pending = {}
+        self._groups = {}
+        self._group_of = {}
+
+    def update(self, buddy):
+        jid = buddy.jid
+        self._contacts[jid] = buddy
+        self._mark(self._subscribed, buddy, buddy.is_subscribed())
+        self._mark(self._pending, buddy, buddy.presence == Presence.PENDING)
+
+        group = self.group_name(buddy)
+        old_group = self._group_of.get(jid)
+        if old_group != group:
+            self._leave_group(jid, old_group)
+        if group is not None:
+            self._groups.setdefault(group, {})[jid] = buddy
+            self._group_of[jid] = group
+
+    def remove(self, buddy):
+        jid = buddy.jid
+        self._contacts.pop(jid, None)
+        self._subscribed.pop(jid, None)
+        self._pending.pop(jid, None)
+        self._leave_group(jid, self._group_of.get(jid))
+
+    def get(self, jid):
+        return self._contacts.get(jid)
+
+    def contacts(self):
+        return self._contacts.values()
+
+    def subscribed(self):
+        return self._subscribed.values()
+
+    def local_pending(self):
+        return self._pending.values()
+
+    def group_members(self, name):
+        return self._groups.get(name, {}).values()
+
+    def group_of(self, jid):
+        return self._group_of.get(jid)
+
+    def groups(self):
+        return self._groups.keys()
+
+    def __len__(self):
+        return len(self._contacts)
+
+    def __contains__(self, jid):
+        return jid in self._contacts
+
+    @staticmethod
+    def group_name(buddy):
+        group = buddy.group
+        if group is None or group.is_root():
+            return None
+        return group.name
+
+    def _mark(self, table, buddy, member):
+        if member:
+            table[buddy.jid] = buddy
+        else:
+            table.pop(buddy.jid, None)
+
+    def _leave_group(self, jid, group):
+        if group is None:
+            return
+        members = self._groups.get(group)
+        if members is not None:
+            members.pop(jid, None)
+            if not members:
+                del self._groups[group]
+        self._group_of.pop(jid, None)
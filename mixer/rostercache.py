@@ -0,0 +1,159 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""On-disk snapshot of the roster"""
+
+import os
+import marshal
+import logging
+
+from mxit.handles import Presence, Mood, BuddyType
+
+from mixer.presence import MixerPresenceMapping
+from mixer.roster import MixerRosterIndex
+
+__all__ = ['RosterCache', 'CachedBuddy']
+
+logger = logging.getLogger('Mixer.RosterCache')
+
+CACHE_VERSION = 1
+
+
+class CachedGroup(object):
+    __slots__ = ['name']
+
+    def __init__(self, name):
+        self.name = name
+
+    def is_root(self):
+        return self.name is None
+
+
+class CachedBuddy(object):
+    """A roster entry as it was when the cache was written. It has the
+    attributes of a PyMXit buddy that the list channels, aliasing and
+    presence code look at."""
+
+    __slots__ = ['jid', 'name', 'group', 'presence', 'mood', 'type', 'subscribed']
+
+    def __init__(self, jid, name, group, presence, room, subscribed):
+        self.jid = jid
+        self.name = name
+        self.group = CachedGroup(group)
+        self.presence = MixerPresenceMapping.to_mxit.get(presence, Presence.OFFLINE)
+        self.mood = Mood.NONE
+        if room:
+            self.type = BuddyType.ROOM
+        else:
+            self.type = BuddyType.MXIT
+        self.subscribed = subscribed
+
+    def is_room(self):
+        return self.type == BuddyType.ROOM
+
+    def is_subscribed(self):
+        return self.subscribed
+
+    def __repr__(self):
+        return "<CachedBuddy %s>" % self.jid
+
+
+def _record(buddy):
+    presence = MixerPresenceMapping.to_telepathy.get(buddy.presence,
+            MixerPresenceMapping.OFFLINE)
+    return (buddy.jid, buddy.name, MixerRosterIndex.group_name(buddy),
+            presence, buddy.is_room(), buddy.is_subscribed())
+
+
+class RosterCache(object):
+    """The roster of one account, kept in a marshal file between sessions.
+
+    load() returns the cached buddies and remembers them as unconfirmed.
+    As the server sends the live roster, confirm() hands back the cached
+    entry of each buddy so the caller can signal only what changed; the
+    entries that are never confirmed are returned by stale()."""
+
+    def __init__(self, path):
+        self.path = path
+        self._unconfirmed = {}
+
+    def load(self):
+        try:
+            file = open(self.path, 'rb')
+            try:
+                version, records = marshal.load(file)
+            finally:
+                file.close()
+        except IOError:
+            return []
+        except (EOFError, ValueError, TypeError), e:
+            logger.warning("Ignoring corrupt roster cache %s: %s" % (self.path, e))
+            return []
+        if version != CACHE_VERSION:
+            logger.info("Ignoring roster cache %s of version %r" % (self.path, version))
+            return []
+
+        buddies = [CachedBuddy(*record) for record in records]
+        self._unconfirmed = dict([(buddy.jid, buddy) for buddy in buddies])
+        logger.info("Loaded %d cached contacts from %s" % (len(buddies), self.path))
+        return buddies
+
+    def save(self, buddies):
+        records = [_record(buddy) for buddy in buddies]
+        temp_path = self.path + '.tmp'
+        try:
+            file = open(temp_path, 'wb')
+            try:
+                marshal.dump((CACHE_VERSION, records), file)
+            finally:
+                file.close()
+            os.rename(temp_path, self.path)
+        except (IOError, OSError), e:
+            logger.warning("Could not write roster cache %s: %s" % (self.path, e))
+
+    def expect(self, buddies):
+        """Remember a snapshot of buddies as unconfirmed, before the server
+        sends the roster again after a reconnect."""
+        self._unconfirmed = {}
+        for buddy in buddies:
+            self._unconfirmed[buddy.jid] = CachedBuddy(*_record(buddy))
+
+    def confirm(self, buddy):
+        """Returns the cached entry for buddy, or None if it was not cached."""
+        return self._unconfirmed.pop(buddy.jid, None)
+
+    def stale(self):
+        """Returns the cached entries that were not confirmed, and forgets them."""
+        stale = self._unconfirmed.values()
+        self._unconfirmed = {}
+        return stale
+
+    def changes(self, cached, buddy):
+        """Compares a cached entry with the live buddy. Returns the set of
+        attributes that differ: 'name', 'group', 'presence' and 'subscription'."""
+        changed = set()
+        if cached.name != buddy.name:
+            changed.add('name')
+        if cached.group.name != MixerRosterIndex.group_name(buddy):
+            changed.add('group')
+        if cached.presence != buddy.presence:
+            changed.add('presence')
+        if cached.is_subscribed() != buddy.is_subscribed() or \
+                (cached.presence == Presence.PENDING) != (buddy.presence == Presence.PENDING):
+            changed.add('subscription')
+        return changed
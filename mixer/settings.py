@@ -0,0 +1,110 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Parsed MXit settings (JAD) files"""
+
+import os
+import logging
+
+from mxit.jadreader import read_jad, parse_url
+
+__all__ = ['MixerSettings', 'SettingsCache']
+
+logger = logging.getLogger('Mixer.Settings')
+
+
+class MixerSettings(object):
+    """The contents of a JAD file, with the connection details parsed.
+
+    Instances are shared between connections and cannot be modified."""
+
+    __slots__ = ['_values', 'protocol', 'host', 'port', 'path',
+            'client_id', 'country_code', 'language']
+
+    def __init__(self, values):
+        set = object.__setattr__
+        set(self, '_values', dict(values))
+        protocol, host, port, path = parse_url(values['sl1'])
+        set(self, 'protocol', protocol)
+        set(self, 'host', host)
+        set(self, 'port', port)
+        set(self, 'path', path)
+        set(self, 'client_id', values['c'])
+        set(self, 'country_code', int(values['cc']))
+        set(self, 'language', values['loc'])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MixerSettings are read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("MixerSettings are read-only")
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+
+class SettingsCache(object):
+    """Parsed settings files, keyed by path.
+
+    A file is read again only when its modification time or size changed
+    since it was parsed."""
+
+    def __init__(self):
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        path = os.path.abspath(path)
+        info = os.stat(path)
+        stamp = (info.st_mtime, info.st_size)
+
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == stamp:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        file = open(path, 'r')
+        try:
+            settings = MixerSettings(read_jad(file))
+        finally:
+            file.close()
+        self._entries[path] = (stamp, settings)
+        logger.info("Settings: %s" % path)
+        return settings
+
+    def invalidate(self, path=None):
+        if path is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(os.path.abspath(path), None)
+
+    def stats(self):
+        return {'files': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses}
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,446 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Connections in worker processes.
+
+The connection manager keeps its bus name and answers GetParameters and
+RequestConnection itself, but with a ShardPool the connections are created
+in worker processes. Every worker runs its own main loop and owns the bus
+names of its connections, so clients talk to the connections directly.
+
+The parent and a worker exchange marshalled tuples over the worker's stdin
+and stdout:
+
+    parent -> worker: ('connect', id, proto, parameters), ('ping',), ('quit',)
+    worker -> parent: ('connected', id, bus_name, object_path),
+                      ('error', id, dbus_error_name, message),
+                      ('disconnected', account), ('pong',)
+"""
+
+import os
+import sys
+import time
+import errno
+import fcntl
+import signal
+import struct
+import marshal
+import logging
+import subprocess
+
+import dbus
+import dbus.mainloop.glib
+import gobject
+import telepathy
+
+from mixer.connection import MixerConnection
+from mixer.settings import SettingsCache
+from mixer.util.logconfig import configure
+
+__all__ = ['ShardPool', 'ShardWorker', 'worker_main']
+
+logger = logging.getLogger('Mixer.Shard')
+
+HEADER = struct.Struct('!I')
+
+WORKER_COMMAND = 'from mixer.shard import worker_main; worker_main()'
+
+_ERROR_NOT_AVAILABLE = 'org.freedesktop.Telepathy.Error.NotAvailable'
+
+
+class FramedPipe(object):
+    """Length-prefixed marshal messages over a pair of file descriptors.
+
+    Both descriptors are non-blocking. What the other side does not read
+    straight away is buffered and written when the pipe is writable again,
+    so a stuck peer cannot block the main loop."""
+
+    def __init__(self, read_fd, write_fd, received, closed):
+        self._read_fd = read_fd
+        self._write_fd = write_fd
+        self._received = received
+        self._closed = closed
+        self._buffer = ''
+        self._output = ''
+        self._write_source = None
+        for fd in (read_fd, write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._source = gobject.io_add_watch(read_fd,
+                gobject.IO_IN | gobject.IO_HUP | gobject.IO_ERR, self._readable)
+
+    def send(self, *message):
+        if self._source is None:
+            return False
+        data = marshal.dumps(message)
+        self._output += HEADER.pack(len(data)) + data
+        if self._write_source is None:
+            if not self._flush():
+                return False
+            if self._output:
+                self._write_source = gobject.io_add_watch(self._write_fd,
+                        gobject.IO_OUT | gobject.IO_HUP | gobject.IO_ERR, self._writable)
+        return True
+
+    def pending(self):
+        """The number of bytes waiting to be written."""
+        return len(self._output)
+
+    def close(self):
+        if self._source is not None:
+            gobject.source_remove(self._source)
+            self._source = None
+        if self._write_source is not None:
+            gobject.source_remove(self._write_source)
+            self._write_source = None
+        self._output = ''
+
+    def _close(self):
+        if self._source is not None:
+            self.close()
+            self._closed()
+
+    def _flush(self):
+        """Write as much of the output as the pipe takes. Returns False if
+        the pipe was closed."""
+        while self._output:
+            try:
+                written = os.write(self._write_fd, self._output)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.EAGAIN:
+                    break
+                logger.warning("Pipe closed: %s" % e)
+                self._close()
+                return False
+            self._output = self._output[written:]
+        return True
+
+    def _writable(self, fd, condition):
+        source = self._write_source
+        # close() must not remove the source that is being dispatched
+        self._write_source = None
+        if not condition & gobject.IO_OUT:
+            logger.warning("Pipe closed while writing")
+            self._close()
+            return False
+        if self._flush() and self._output:
+            self._write_source = source
+            return True
+        return False
+
+    def _readable(self, fd, condition):
+        chunk = ''
+        if condition & gobject.IO_IN:
+            try:
+                chunk = os.read(fd, 65536)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return True
+        if not chunk:
+            self._source = None
+            self.close()
+            self._closed()
+            return False
+
+        self._buffer += chunk
+        while len(self._buffer) >= HEADER.size:
+            length, = HEADER.unpack(self._buffer[:HEADER.size])
+            end = HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            try:
+                message = marshal.loads(self._buffer[HEADER.size:end])
+            except (ValueError, EOFError, TypeError), e:
+                logger.error("Corrupt message on pipe, closing it: %s" % e)
+                self._buffer = ''
+                self._source = None
+                self.close()
+                self._closed()
+                return False
+            self._buffer = self._buffer[end:]
+            self._received(*message)
+            if self._source is None:
+                # closed by the receiver
+                return False
+        return True
+
+
+def _plain(value):
+    """Convert a D-Bus parameter value to a type marshal can write."""
+    if isinstance(value, dbus.Boolean):
+        return bool(value)
+    if isinstance(value, (int, long)):
+        return long(value)
+    if isinstance(value, basestring):
+        return unicode(value)
+    raise telepathy.InvalidArgument("Unsupported parameter value %r" % (value,))
+
+
+class Shard(object):
+    """The parent's end of a worker process."""
+
+    def __init__(self, pool, index):
+        self.index = index
+        self.accounts = set()
+        self.pending = {}
+        self.missed = 0
+        self.alive = True
+        self.started = time.time()
+        self._pool = pool
+
+        self._process = subprocess.Popen([sys.executable, '-c', WORKER_COMMAND],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+        self.pid = self._process.pid
+        self._pipe = FramedPipe(self._process.stdout.fileno(),
+                self._process.stdin.fileno(), self._received, self._closed)
+        gobject.child_watch_add(self.pid, self._exited)
+        logger.info("Started worker %d (pid %d)" % (index, self.pid))
+
+    def load(self):
+        return len(self.accounts) + len(self.pending)
+
+    def send(self, *message):
+        return self._pipe.send(*message)
+
+    def kill(self):
+        if self.alive:
+            logger.warning("Killing worker %d (pid %d)" % (self.index, self.pid))
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self._closed()
+
+    def stats(self):
+        return {'pid': self.pid,
+                'accounts': len(self.accounts),
+                'pending': len(self.pending),
+                'missed_pings': self.missed,
+                'uptime': time.time() - self.started}
+
+    def _received(self, command, *args):
+        if command == 'connected':
+            request_id, bus_name, object_path = args
+            account, success, error = self.pending.pop(request_id)
+            self.accounts.add(account)
+            success(bus_name, object_path)
+        elif command == 'error':
+            request_id, name, message = args
+            account, success, error = self.pending.pop(request_id)
+            error(dbus.DBusException(message, name=name))
+        elif command == 'disconnected':
+            account, = args
+            self.accounts.discard(account)
+            self._pool._account_disconnected(self, account)
+        elif command == 'pong':
+            self.missed = 0
+        else:
+            logger.warning("Unknown message from worker %d: %r" % (self.index, command))
+
+    def _closed(self):
+        if not self.alive:
+            return
+        self.alive = False
+        self._pipe.close()
+        self._process.stdin.close()
+        self._process.stdout.close()
+        for account, success, error in self.pending.values():
+            error(telepathy.NotAvailable("Worker process exited"))
+        self.pending = {}
+        self._pool._shard_lost(self)
+
+    def _exited(self, pid, status):
+        logger.info("Worker %d (pid %d) exited with status %d" % (self.index, pid, status))
+        self._closed()
+
+
+class ShardPool(object):
+    """Spreads connections over up to max_workers worker processes.
+
+    An account goes back to the worker it last ran on as long as that worker
+    is alive and has room; otherwise the least loaded worker with fewer than
+    accounts_per_worker accounts is used, starting a new one if needed.
+    Workers are pinged every health_interval milliseconds and killed after
+    max_missed unanswered pings."""
+
+    def __init__(self, max_workers, accounts_per_worker=50, disconnected=None,
+            health_interval=10000, max_missed=3):
+        self.max_workers = max_workers
+        self.accounts_per_worker = accounts_per_worker
+        self.max_missed = max_missed
+        self._disconnected = disconnected
+        self._shards = []
+        self._affinity = {}
+        self._next_index = 0
+        self._next_request = 0
+        self._health_source = gobject.timeout_add(health_interval, self._check_health)
+
+        self.requests = 0
+        self.rejected = 0
+        self.lost = 0
+
+    def request(self, proto, parameters, success, error):
+        """Ask a worker for a connection; calls success(bus_name, object_path)
+        or error(exception)."""
+        self.requests += 1
+        account = unicode(parameters.get('account', ''))
+        shard = self._choose(account)
+        if shard is None:
+            self.rejected += 1
+            error(telepathy.NotAvailable("All %d workers are full" % len(self._shards)))
+            return
+        params = {}
+        for name, value in parameters.iteritems():
+            params[unicode(name)] = _plain(value)
+
+        self._next_request += 1
+        request_id = self._next_request
+        shard.pending[request_id] = (account, success, error)
+        self._affinity[account] = shard
+        # if the worker is gone, the request fails through Shard._closed
+        shard.send('connect', request_id, proto, params)
+
+    def accounts(self):
+        return sum([shard.load() for shard in self._shards])
+
+    def shutdown(self):
+        gobject.source_remove(self._health_source)
+        for shard in self._shards:
+            shard.send('quit')
+
+    def stats(self):
+        return {'workers': [shard.stats() for shard in self._shards],
+                'accounts': self.accounts(),
+                'requests': self.requests,
+                'rejected': self.rejected,
+                'lost_workers': self.lost}
+
+    def _choose(self, account):
+        shard = self._affinity.get(account)
+        if shard is not None and shard.alive and \
+                shard.load() < self.accounts_per_worker:
+            return shard
+
+        candidates = [shard for shard in self._shards
+                if shard.load() < self.accounts_per_worker]
+        if candidates:
+            return min(candidates, key=lambda shard: shard.load())
+        if len(self._shards) < self.max_workers:
+            shard = Shard(self, self._next_index)
+            self._next_index += 1
+            self._shards.append(shard)
+            return shard
+        return None
+
+    def _check_health(self):
+        for shard in list(self._shards):
+            if shard.missed >= self.max_missed:
+                logger.error("Worker %d did not answer %d pings" % (shard.index, shard.missed))
+                shard.kill()
+            else:
+                shard.missed += 1
+                shard.send('ping')
+        return True
+
+    def _account_disconnected(self, shard, account):
+        if self._disconnected is not None:
+            self._disconnected()
+
+    def _shard_lost(self, shard):
+        if shard in self._shards:
+            self._shards.remove(shard)
+            self.lost += 1
+        for account, owner in self._affinity.items():
+            if owner is shard:
+                del self._affinity[account]
+        if shard.accounts and self._disconnected is not None:
+            self._disconnected()
+
+
+class ShardWorker(object):
+    """The worker's end: creates connections on request of the parent and
+    stands in for the connection manager towards them."""
+
+    protos = {'mxit': MixerConnection}
+
+    def __init__(self, read_fd, write_fd, quit):
+        self.settings_cache = SettingsCache()
+        self._connections = set()
+        self._quit = quit
+        self._quitting = False
+        self._pipe = FramedPipe(read_fd, write_fd, self._received, self._parent_gone)
+
+    def disconnected(self, conn):
+        """Called by the connections, like MixerConnectionManager.disconnected."""
+        self._connections.discard(conn)
+        self._pipe.send('disconnected', conn._account)
+
+    def _received(self, command, *args):
+        if command == 'connect':
+            self._connect(*args)
+        elif command == 'ping':
+            self._pipe.send('pong')
+        elif command == 'quit':
+            self._shutdown()
+
+    def _connect(self, request_id, proto, parameters):
+        try:
+            if proto not in self.protos:
+                raise telepathy.NotImplemented('unknown protocol %s' % proto)
+            conn = self.protos[proto](self, parameters)
+        except dbus.DBusException, e:
+            self._pipe.send('error', request_id, e.get_dbus_name(), str(e))
+        except Exception, e:
+            logger.exception(e)
+            self._pipe.send('error', request_id, _ERROR_NOT_AVAILABLE, str(e))
+        else:
+            self._connections.add(conn)
+            self._pipe.send('connected', request_id, conn._name.get_name(),
+                    conn._object_path)
+
+    def _parent_gone(self):
+        logger.warning("Connection manager went away")
+        self._shutdown()
+
+    def _shutdown(self):
+        if self._quitting:
+            return
+        self._quitting = True
+        for conn in list(self._connections):
+            conn.Disconnect()
+        def quit():
+            self._quit()
+            return False
+        gobject.timeout_add(5000, quit)
+
+
+def worker_main():
+    # stdout carries the messages to the parent, anything printed goes to stderr
+    output = os.dup(1)
+    os.dup2(2, 1)
+    # the environment, and with it the log settings, is inherited
+    log_handler = configure()
+    gobject.threads_init()
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+
+    mainloop = gobject.MainLoop()
+    worker = ShardWorker(0, output, mainloop.quit)
+    mainloop.run()
+    log_handler.close()
@@ -0,0 +1,110 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import os
+import mmap
+import logging
+import tempfile
+import exceptions
+
+__all__ = ['TransferSpool', 'SpoolFile', 'SpoolFull']
+
+logger = logging.getLogger('Mixer.Spool')
+
+
+class SpoolFull(exceptions.Exception):
+    pass
+
+
+class TransferSpool(object):
+    """Temporary files for incoming file transfers.
+
+    At most max_transfers files can be open at once, and together they may
+    not be larger than quota bytes (0 for no limit)."""
+
+    def __init__(self, max_transfers=4, quota=0, directory=None):
+        self.max_transfers = max_transfers
+        self.quota = quota
+        self.directory = directory
+        self._files = set()
+        self.used = 0
+
+    def create(self, size):
+        """Reserve size bytes and return a new SpoolFile, or raise SpoolFull."""
+        if self.max_transfers and len(self._files) >= self.max_transfers:
+            raise SpoolFull("%d transfers already in progress" % len(self._files))
+        if self.quota and self.used + size > self.quota:
+            raise SpoolFull("spool quota of %d bytes exceeded" % self.quota)
+        spool_file = SpoolFile(self, size)
+        self._files.add(spool_file)
+        self.used += size
+        return spool_file
+
+    def __len__(self):
+        return len(self._files)
+
+    def _resize(self, spool_file, size):
+        self.used += size - spool_file.reserved
+
+    def _release(self, spool_file):
+        if spool_file in self._files:
+            self._files.remove(spool_file)
+            self.used -= spool_file.reserved
+
+
+class SpoolFile(object):
+    """A file being received. The data is written to an unlinked temporary
+    file, and handed to the client from a read-only memory map of it."""
+
+    def __init__(self, spool, size):
+        self._spool = spool
+        self.reserved = size
+        self.size = 0
+        fd, path = tempfile.mkstemp(prefix='tp-mixer-in-', dir=spool.directory)
+        os.unlink(path)
+        self._file = os.fdopen(fd, 'w+b')
+        self._map = None
+
+    def write(self, data):
+        self._file.write(data)
+        self.size += len(data)
+        if self.size > self.reserved:
+            self._spool._resize(self, self.size)
+            self.reserved = self.size
+
+    def map(self):
+        """Returns the received data as an mmap (or an empty string)."""
+        if self._map is None:
+            self._file.flush()
+            if self.size == 0:
+                return ''
+            self._map = mmap.mmap(self._file.fileno(), self.size,
+                    access=mmap.ACCESS_READ)
+        return self._map
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._spool._release(self)
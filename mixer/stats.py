@@ -0,0 +1,100 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Stats interface of the connection manager"""
+
+import logging
+
+import dbus
+
+from mixer.util.instrument import registry, HISTOGRAM_BOUNDS
+
+__all__ = ['MixerStats', 'STATS_INTERFACE']
+
+logger = logging.getLogger('Mixer.Stats')
+
+STATS_INTERFACE = 'org.freedesktop.Telepathy.ConnectionManager.Interface.Mixer.Stats'
+
+
+class MixerStats(dbus.service.Interface):
+    """Publishes the counters of mixer.util.instrument.
+
+    GetStats returns, per instrumented function, a dict with 'calls',
+    'errors', 'total', 'mean', 'max', 'p50', 'p99' (seconds) and 'histogram',
+    the call counts per bucket of GetHistogramBounds plus one bucket for
+    slower calls.
+
+    GetConnectionStats returns the counters of the connections in this
+    process, keyed by "<account> <section>", see
+    MixerConnection.connection_stats. They are kept whether or not
+    instrumentation is enabled."""
+
+    # seconds between dumps of the counters to the log, 0 for none
+    stats_dump_interval = 300
+
+    def __init__(self):
+        if self.stats_dump_interval:
+            registry.start_dumping(self.stats_dump_interval)
+
+    @dbus.service.method(STATS_INTERFACE, in_signature='', out_signature='b')
+    def GetEnabled(self):
+        return registry.enabled
+
+    @dbus.service.method(STATS_INTERFACE, in_signature='b', out_signature='')
+    def SetEnabled(self, enabled):
+        logger.info("Instrumentation %s" % (enabled and "enabled" or "disabled"))
+        registry.enabled = bool(enabled)
+
+    @dbus.service.method(STATS_INTERFACE, in_signature='', out_signature='a{sa{sv}}')
+    def GetStats(self):
+        result = {}
+        for name, info in registry.snapshot().iteritems():
+            result[name] = {'calls': dbus.UInt64(info['calls']),
+                    'errors': dbus.UInt64(info['errors']),
+                    'total': dbus.Double(info['total']),
+                    'mean': dbus.Double(info['mean']),
+                    'max': dbus.Double(info['max']),
+                    'p50': dbus.Double(info['p50']),
+                    'p99': dbus.Double(info['p99']),
+                    'histogram': dbus.Array(info['histogram'], signature='t')}
+        return result
+
+    @dbus.service.method(STATS_INTERFACE, in_signature='', out_signature='a{sa{sv}}')
+    def GetConnectionStats(self):
+        result = {}
+        for connection in self._connections:
+            for section, stats in connection.connection_stats().iteritems():
+                values = {}
+                for name, value in stats.iteritems():
+                    if isinstance(value, float):
+                        values[name] = dbus.Double(value)
+                    else:
+                        values[name] = dbus.Int64(value)
+                result['%s %s' % (connection._account, section)] = values
+        return result
+
+    @dbus.service.method(STATS_INTERFACE, in_signature='', out_signature='ad')
+    def GetHistogramBounds(self):
+        return HISTOGRAM_BOUNDS
+
+    @dbus.service.method(STATS_INTERFACE, in_signature='', out_signature='')
+    def Reset(self):
+        registry.reset()
+
+    def stop_stats(self):
+        registry.stop_dumping()
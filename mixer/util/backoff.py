@@ -0,0 +1,92 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Retries with exponential backoff"""
+
+import random
+
+import gobject
+
+__all__ = ['Backoff']
+
+
+class Backoff(object):
+    """Call func after a delay that doubles with every attempt.
+
+    The n-th attempt is made between half and all of
+    min(initial * factor ** n, maximum) milliseconds after schedule(), so
+    that many clients that failed together do not retry together. After
+    budget attempts without a reset() schedule() refuses to try again."""
+
+    def __init__(self, func, initial=1000, maximum=300000, factor=2.0, budget=10):
+        self._func = func
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.budget = budget
+        self.attempts = 0
+        self._source = None
+
+        self.total_attempts = 0
+        self.successes = 0
+        self.exhausted = 0
+
+    def schedule(self):
+        """Arm the timer for the next attempt. Returns False if the retry
+        budget is used up."""
+        if self._source is not None:
+            return True
+        if self.budget and self.attempts >= self.budget:
+            self.exhausted += 1
+            return False
+        delay = self.delay()
+        self.attempts += 1
+        self.total_attempts += 1
+        self._source = gobject.timeout_add(delay, self._timeout)
+        return True
+
+    def delay(self):
+        """The delay in milliseconds before the next attempt."""
+        ceiling = min(self.initial * self.factor ** self.attempts, self.maximum)
+        return int(ceiling / 2 + random.uniform(0, ceiling / 2))
+
+    def reset(self):
+        """The last attempt succeeded."""
+        self.cancel()
+        if self.attempts:
+            self.successes += 1
+        self.attempts = 0
+
+    def cancel(self):
+        if self._source is not None:
+            gobject.source_remove(self._source)
+            self._source = None
+
+    def pending(self):
+        return self._source is not None
+
+    def stats(self):
+        return {'attempts': self.attempts,
+                'total_attempts': self.total_attempts,
+                'successes': self.successes,
+                'exhausted': self.exhausted}
+
+    def _timeout(self):
+        self._source = None
+        self._func()
+        return False
@@ -0,0 +1,106 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Coalescing of D-Bus signals"""
+
+import gobject
+
+from mixer.util.scheduler import scheduler, PRIORITY_LOW
+
+__all__ = ['SignalBatcher']
+
+
+class SignalBatcher(object):
+    """Collect updates keyed by handle and hand them over in batches.
+
+    Updates for the same key are merged, the last one wins. A batch is
+    flushed interval milliseconds after its first update arrived (at the next
+    mainloop idle state if interval is 0), or as soon as it holds limit
+    entries. The flush itself is queued on the idle scheduler."""
+
+    def __init__(self, flush_func, interval=0, limit=0, priority=PRIORITY_LOW):
+        self._flush_func = flush_func
+        self.interval = interval
+        self.limit = limit
+        self.priority = priority
+        self._pending = {}
+        self._source = None
+        self._queued = False
+
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+
+    def add(self, key, value=None):
+        self._pending[key] = value
+        if self.limit and len(self._pending) >= self.limit:
+            self.flush()
+        elif self._source is None and not self._queued:
+            if self.interval:
+                self._source = gobject.timeout_add(self.interval, self._timeout)
+            else:
+                self._queue()
+
+    def flush(self):
+        """Emit the pending batch right away."""
+        if self._source is not None:
+            gobject.source_remove(self._source)
+            self._source = None
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = {}
+
+        self.batches += 1
+        self.items += len(pending)
+        self.largest = max(self.largest, len(pending))
+        self._flush_func(pending)
+
+    def discard(self):
+        """Drop the pending batch without emitting it."""
+        if self._source is not None:
+            gobject.source_remove(self._source)
+            self._source = None
+        self._pending = {}
+
+    def stats(self):
+        if self.batches:
+            average = float(self.items) / self.batches
+        else:
+            average = 0.0
+        return {'batches': self.batches,
+                'items': self.items,
+                'largest': self.largest,
+                'average': average,
+                'pending': len(self._pending)}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _timeout(self):
+        self._source = None
+        self._queue()
+        return False
+
+    def _queue(self):
+        self._queued = True
+        scheduler.schedule(self.priority, self._scheduled_flush)
+
+    def _scheduled_flush(self):
+        self._queued = False
+        self.flush()
@@ -27,8 +27,11 @@ import exceptions
 
 import gobject
 
+from mixer.util.scheduler import scheduler, PRIORITY_DEFAULT
+from mixer.util.ratelimit import TokenBucket
+
 __all__ = ['decorator', 'rw_property', 'deprecated', 'unstable', 'async',
-        'throttled', 'logexceptions']
+        'scheduled', 'throttled', 'logexceptions']
 
 
 def decorator(function):
@@ -86,40 +89,32 @@ def async(func):
     """Make a function mainloop friendly. the function will be called at the
     next mainloop idle state."""
     def new_function(*args, **kwargs):
-        def async_function():
-            func(*args, **kwargs)
-            return False
-        gobject.idle_add(async_function)
+        scheduler.schedule(PRIORITY_DEFAULT, func, *args, **kwargs)
     return new_function
 
+def scheduled(priority):
+    """Like async, but the call is queued with the given scheduler priority,
+    see mixer.util.scheduler."""
+    @decorator
+    def scheduled_decorator(func):
+        def new_function(*args, **kwargs):
+            scheduler.schedule(priority, func, *args, **kwargs)
+        return new_function
+    return scheduled_decorator
+
 class throttled(object):
-    """Throttle the calls to a function by queueing all the calls that happen
-    before the minimum delay."""
+    """Throttle the calls to a function to one per min_delay milliseconds,
+    queueing the calls that happen before the minimum delay.
 
-    def __init__(self, min_delay, queue):
-        self._min_delay = min_delay
-        self._queue = queue
-        self._last_call_time = None
+    queue is no longer used, the calls are kept in a TokenBucket."""
 
-    def __call__(self, func):
-        def process_queue():
-            if len(self._queue) != 0:
-                func, args, kwargs = self._queue.pop(0)
-                self._last_call_time = time.time() * 1000
-                func(*args, **kwargs)
-            return False
+    def __init__(self, min_delay, queue=None):
+        self._bucket = TokenBucket(1000.0 / min_delay, 1)
 
+    def __call__(self, func):
+        bucket = self._bucket
         def new_function(*args, **kwargs):
-            now = time.time() * 1000
-            if self._last_call_time is None or \
-                    now - self._last_call_time >= self._min_delay:
-                self._last_call_time = now
-                func(*args, **kwargs)
-            else:
-                self._queue.append((func, args, kwargs))
-                last_call_delta = now - self._last_call_time
-                process_queue_timeout = int(self._min_delay * len(self._queue) - last_call_delta)
-                gobject.timeout_add(process_queue_timeout, process_queue)
+            bucket.submit(func, *args, **kwargs)
                 
         new_function.__name__ = func.__name__
         new_function.__doc__ = func.__doc__
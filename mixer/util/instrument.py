@@ -0,0 +1,163 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Call counts and latency histograms.
+
+Functions decorated with instrumented() report to the module's registry.
+While the registry is disabled (the default, unless MIXER_STATS is set in
+the environment) a call costs one attribute check."""
+
+import os
+import time
+import bisect
+import logging
+import types
+
+import gobject
+
+from mixer.util.decorator import decorator
+
+__all__ = ['instrumented', 'instrument_methods', 'registry', 'HISTOGRAM_BOUNDS']
+
+logger = logging.getLogger('Mixer.Stats')
+
+# Upper bounds of the histogram buckets in seconds: 1us, 2us, 4us ... ~16s.
+# The last bucket counts everything slower.
+HISTOGRAM_BOUNDS = [2 ** i / 1000000.0 for i in range(25)]
+
+
+class CallStats(object):
+    __slots__ = ['calls', 'errors', 'total', 'max', 'histogram']
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def add(self, duration):
+        self.calls += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        self.histogram[bisect.bisect_left(HISTOGRAM_BOUNDS, duration)] += 1
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of calls."""
+        wanted = fraction * self.calls
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= wanted:
+                if i < len(HISTOGRAM_BOUNDS):
+                    return HISTOGRAM_BOUNDS[i]
+                return self.max
+        return 0.0
+
+    def as_dict(self):
+        if self.calls:
+            mean = self.total / self.calls
+        else:
+            mean = 0.0
+        return {'calls': self.calls,
+                'errors': self.errors,
+                'total': self.total,
+                'mean': mean,
+                'max': self.max,
+                'p50': self.percentile(0.5),
+                'p99': self.percentile(0.99),
+                'histogram': list(self.histogram)}
+
+
+class StatsRegistry(object):
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._stats = {}
+        self._dump_source = None
+
+    def get(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = CallStats()
+        return stats
+
+    def snapshot(self):
+        result = {}
+        for name, stats in self._stats.iteritems():
+            result[name] = stats.as_dict()
+        return result
+
+    def reset(self):
+        self._stats = {}
+
+    def dump(self, limit=20):
+        """Log the entries with the most time spent."""
+        entries = self._stats.items()
+        entries.sort(key=lambda entry: entry[1].total, reverse=True)
+        for name, stats in entries[:limit]:
+            info = stats.as_dict()
+            logger.info("%s: %d calls, %d errors, %.3fs total, mean %.6fs, p99 <%.6fs, max %.6fs"
+                    % (name, info['calls'], info['errors'], info['total'],
+                       info['mean'], info['p99'], info['max']))
+
+    def start_dumping(self, interval):
+        """Dump to the log every interval seconds."""
+        self.stop_dumping()
+        def dump():
+            if self.enabled:
+                self.dump()
+            return True
+        self._dump_source = gobject.timeout_add(int(interval * 1000), dump)
+
+    def stop_dumping(self):
+        if self._dump_source is not None:
+            gobject.source_remove(self._dump_source)
+            self._dump_source = None
+
+
+registry = StatsRegistry('MIXER_STATS' in os.environ)
+
+
+def instrumented(name):
+    """Record calls, latency and exceptions of the function under name."""
+    @decorator
+    def instrument_decorator(func):
+        def new_function(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            stats = registry.get(name)
+            start = time.time()
+            try:
+                result = func(*args, **kwargs)
+            except:
+                stats.errors += 1
+                stats.add(time.time() - start)
+                raise
+            stats.add(time.time() - start)
+            return result
+        return new_function
+    return instrument_decorator
+
+
+def instrument_methods(cls, prefix):
+    """Instrument every public method defined in cls as prefix.method."""
+    for attr, value in cls.__dict__.items():
+        if not attr.startswith('_') and isinstance(value, types.FunctionType):
+            setattr(cls, attr, instrumented('%s.%s' % (prefix, attr))(value))
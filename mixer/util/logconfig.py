@@ -0,0 +1,207 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Logging setup.
+
+configure() sets up the root logger from the environment, or from an ini
+file named by MIXER_LOG_CONFIG with the keys levels, file, async and repeat
+in a [logging] section:
+
+    MIXER_LOG         levels, e.g. "info,Mixer.Listener=debug,Mixer.Shard=warning"
+                      (default "debug")
+    MIXER_LOG_FILE    append to this file instead of writing to stderr
+    MIXER_LOG_ASYNC   if set, the file is written by a background thread
+    MIXER_LOG_REPEAT  "count/seconds": at most count messages from one log
+                      statement per period (default "20/10", "0" for no limit);
+                      warnings and errors are never suppressed
+
+The environment overrides the file. Log with arguments, as in
+logger.debug("%s joined", name), so that messages below the level are
+never formatted."""
+
+import os
+import sys
+import Queue
+import logging
+import threading
+import ConfigParser
+
+__all__ = ['configure', 'RepeatFilter', 'AsyncHandler']
+
+FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+DEFAULTS = {'levels': 'debug',
+            'file': '',
+            'async': '',
+            'repeat': '20/10'}
+
+_STOP = object()
+
+
+class RepeatFilter(logging.Filter):
+    """Passes at most count records per period seconds from each log
+    statement. The next record that passes says how many were dropped.
+    Warnings and errors always pass."""
+
+    def __init__(self, count, period):
+        logging.Filter.__init__(self)
+        self.count = count
+        self.period = period
+        # (pathname, lineno) -> [period start, records passed, records dropped]
+        self._sites = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        site = self._sites.get(key)
+        if site is None or now - site[0] >= self.period:
+            dropped = site and site[2] or 0
+            site = self._sites[key] = [now, 0, 0]
+            if dropped:
+                record.msg = "%s [%d similar messages suppressed]" % (record.msg, dropped)
+        if site[1] >= self.count:
+            site[2] += 1
+            return False
+        site[1] += 1
+        return True
+
+
+class AsyncHandler(logging.Handler):
+    """Hands records to target from a background thread, so that writing
+    does not hold up the mainloop.
+
+    The message and traceback are formatted in the calling thread, so the
+    record no longer refers to the arguments, which may change or be
+    shared with the mainloop. Only the I/O is left to the thread."""
+
+    def __init__(self, target):
+        logging.Handler.__init__(self)
+        self.target = target
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='log-writer')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def emit(self, record):
+        try:
+            self._queue.put(self.prepare(record))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+            self.target.close()
+        logging.Handler.close(self)
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                return
+            self.target.handle(record)
+
+
+def parse_levels(spec):
+    """Parses "level,name=level,..." into (root level, {name: level})."""
+    root = logging.DEBUG
+    levels = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = _level(level)
+        else:
+            root = _level(item)
+    return root, levels
+
+
+def _level(name):
+    level = logging.getLevelName(name.strip().upper())
+    if not isinstance(level, int):
+        raise ValueError("Unknown log level %r" % name)
+    return level
+
+
+def _settings(environ):
+    settings = dict(DEFAULTS)
+    path = environ.get('MIXER_LOG_CONFIG')
+    if path:
+        parser = ConfigParser.RawConfigParser()
+        if parser.read([path]) and parser.has_section('logging'):
+            settings.update(parser.items('logging'))
+    for key in DEFAULTS:
+        variable = 'MIXER_LOG_%s' % key.upper()
+        if key == 'levels':
+            variable = 'MIXER_LOG'
+        if variable in environ:
+            settings[key] = environ[variable]
+    return settings
+
+
+def configure(environ=os.environ, stream=None):
+    """Sets up the root logger, see the module documentation. Returns the
+    handler, which should be closed on exit."""
+    settings = _settings(environ)
+    try:
+        root_level, levels = parse_levels(settings['levels'])
+    except ValueError, e:
+        sys.stderr.write("Ignoring log levels: %s\n" % e)
+        root_level, levels = logging.DEBUG, {}
+
+    if settings['file']:
+        handler = logging.FileHandler(settings['file'])
+    else:
+        handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    if settings['file'] and settings['async']:
+        handler = AsyncHandler(handler)
+
+    repeat = settings['repeat']
+    if repeat and repeat != '0':
+        try:
+            count, period = repeat.split('/', 1)
+            handler.addFilter(RepeatFilter(int(count), float(period)))
+        except ValueError:
+            sys.stderr.write("Ignoring repeat limit %r\n" % repeat)
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(root_level)
+    for name, level in levels.iteritems():
+        logging.getLogger(name).setLevel(level)
+    return handler
@@ -0,0 +1,212 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Token bucket rate limiting"""
+
+import collections
+import exceptions
+import logging
+import math
+import time
+
+import gobject
+
+__all__ = ['TokenBucket', 'RateLimiter', 'RateLimitExceeded',
+        'OVERFLOW_DROP_OLDEST', 'OVERFLOW_COALESCE', 'OVERFLOW_REJECT']
+
+logger = logging.getLogger('Mixer.RateLimit')
+
+# What happens to a call when the queue is full:
+# the oldest queued call is dropped to make room
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+# a queued call of the same function takes the new arguments, otherwise
+# the new call is dropped
+OVERFLOW_COALESCE = 'coalesce'
+# RateLimitExceeded is raised
+OVERFLOW_REJECT = 'reject'
+
+
+class RateLimitExceeded(exceptions.Exception):
+    pass
+
+
+class TokenBucket(object):
+    """Run calls at most rate times per second, in bursts of up to burst
+    calls.
+
+    Calls that cannot run straight away are queued. At most one timer is
+    armed per bucket, for the moment the next token becomes available."""
+
+    def __init__(self, rate, burst=1, max_queue=0, overflow=OVERFLOW_REJECT):
+        self.rate = float(rate)
+        self.burst = burst
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._queue = collections.deque()
+        self._coalesce = {}
+        self._source = None
+
+        self.calls = 0
+        self.queued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def submit(self, func, *args, **kwargs):
+        """Run func now if a token is available, otherwise queue it.
+
+        Returns True if the call was made straight away."""
+        self._refill()
+        if not self._queue and self._tokens >= 1:
+            self._tokens -= 1
+            self.calls += 1
+            func(*args, **kwargs)
+            return True
+
+        if self.overflow == OVERFLOW_COALESCE:
+            entry = self._coalesce.get(func)
+            if entry is not None:
+                entry[1] = args
+                entry[2] = kwargs
+                self.coalesced += 1
+                return False
+
+        if self.max_queue and len(self._queue) >= self.max_queue:
+            if self.overflow == OVERFLOW_DROP_OLDEST:
+                self._forget(self._queue.popleft())
+                self.dropped += 1
+            elif self.overflow == OVERFLOW_COALESCE:
+                self.dropped += 1
+                return False
+            else:
+                self.rejected += 1
+                raise RateLimitExceeded("%d calls already queued" % len(self._queue))
+
+        entry = [func, args, kwargs]
+        self._queue.append(entry)
+        if self.overflow == OVERFLOW_COALESCE:
+            self._coalesce[func] = entry
+        self.queued += 1
+        self._arm()
+        return False
+
+    def pending(self):
+        return len(self._queue)
+
+    def idle(self):
+        """True if nothing is queued and the bucket is full again."""
+        self._refill()
+        return not self._queue and self._tokens >= self.burst
+
+    def cancel(self):
+        if self._source is not None:
+            gobject.source_remove(self._source)
+            self._source = None
+        self._queue.clear()
+        self._coalesce.clear()
+
+    def stats(self):
+        return {'calls': self.calls,
+                'queued': self.queued,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'rejected': self.rejected,
+                'pending': len(self._queue)}
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _arm(self):
+        if self._source is None:
+            delay = max(0.0, (1 - self._tokens) / self.rate)
+            self._source = gobject.timeout_add(int(math.ceil(delay * 1000)), self._timeout)
+
+    def _forget(self, entry):
+        # only coalescing buckets need func to be hashable
+        if self._coalesce and self._coalesce.get(entry[0]) is entry:
+            del self._coalesce[entry[0]]
+
+    def _timeout(self):
+        self._source = None
+        self._refill()
+        while self._queue and self._tokens >= 1:
+            entry = self._queue.popleft()
+            self._forget(entry)
+            self._tokens -= 1
+            self.calls += 1
+            func, args, kwargs = entry
+            # a failing call must not strand the calls queued behind it
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception("Queued call to %r failed" % (func,))
+        if self._queue:
+            self._arm()
+        return False
+
+
+class RateLimiter(object):
+    """A TokenBucket per key, for instance per recipient.
+
+    Buckets are created on demand; once there are more than max_buckets,
+    idle buckets are discarded."""
+
+    def __init__(self, rate, burst=1, max_queue=0, overflow=OVERFLOW_REJECT,
+            max_buckets=1000):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.max_buckets = max_buckets
+        self._buckets = {}
+
+    def submit(self, key, func, *args, **kwargs):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._prune()
+            bucket = TokenBucket(self.rate, self.burst, self.max_queue, self.overflow)
+            self._buckets[key] = bucket
+        return bucket.submit(func, *args, **kwargs)
+
+    def pending(self, key=None):
+        if key is not None:
+            bucket = self._buckets.get(key)
+            return bucket and bucket.pending() or 0
+        return sum([bucket.pending() for bucket in self._buckets.itervalues()])
+
+    def cancel(self):
+        for bucket in self._buckets.itervalues():
+            bucket.cancel()
+        self._buckets = {}
+
+    def stats(self):
+        result = {'buckets': len(self._buckets)}
+        for bucket in self._buckets.itervalues():
+            for name, value in bucket.stats().iteritems():
+                result[name] = result.get(name, 0) + value
+        return result
+
+    def _prune(self):
+        for key, bucket in self._buckets.items():
+            if bucket.idle():
+                del self._buckets[key]
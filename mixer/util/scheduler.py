@@ -0,0 +1,117 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Deferred work run from the mainloop idle state"""
+
+import heapq
+import logging
+import time
+
+import gobject
+
+__all__ = ['IdleScheduler', 'scheduler', 'PRIORITY_HIGH', 'PRIORITY_DEFAULT',
+        'PRIORITY_LOW']
+
+logger = logging.getLogger('Mixer.Scheduler')
+
+# Method replies and outgoing messages
+PRIORITY_HIGH = 0
+PRIORITY_DEFAULT = 100
+# Bulk roster signals
+PRIORITY_LOW = 200
+
+
+class IdleScheduler(object):
+    """Run queued calls from a single mainloop idle source.
+
+    Calls run in priority order, first come first served within a priority.
+    The queue is drained in slices of at most slice_time seconds; between
+    slices the mainloop gets to dispatch D-Bus traffic."""
+
+    def __init__(self, slice_time=0.01):
+        self.slice_time = slice_time
+        self._queue = []
+        self._sequence = 0
+        self._source = None
+
+        self.calls = 0
+        self.errors = 0
+        self.slices = 0
+        self.max_depth = 0
+        self.last_slice = 0.0
+        self.max_slice = 0.0
+        self.total_slice = 0.0
+
+    def schedule(self, priority, func, *args, **kwargs):
+        self._sequence += 1
+        heapq.heappush(self._queue, (priority, self._sequence, func, args, kwargs))
+        if len(self._queue) > self.max_depth:
+            self.max_depth = len(self._queue)
+        if self._source is None:
+            self._source = gobject.idle_add(self._run)
+
+    def depth(self):
+        return len(self._queue)
+
+    def stats(self):
+        if self.slices:
+            average = self.total_slice / self.slices
+        else:
+            average = 0.0
+        return {'depth': len(self._queue),
+                'max_depth': self.max_depth,
+                'calls': self.calls,
+                'errors': self.errors,
+                'slices': self.slices,
+                'last_slice_ms': self.last_slice * 1000,
+                'max_slice_ms': self.max_slice * 1000,
+                'average_slice_ms': average * 1000}
+
+    def _run(self):
+        queue = self._queue
+        start = time.time()
+        deadline = start + self.slice_time
+        while queue:
+            priority, sequence, func, args, kwargs = heapq.heappop(queue)
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                self.errors += 1
+                logger.exception("Scheduled call to %s failed" %
+                        getattr(func, '__name__', func))
+            self.calls += 1
+            if time.time() >= deadline:
+                break
+
+        elapsed = time.time() - start
+        self.slices += 1
+        self.last_slice = elapsed
+        self.total_slice += elapsed
+        if elapsed > self.max_slice:
+            self.max_slice = elapsed
+        if elapsed > 5 * self.slice_time:
+            logger.warning("Idle slice took %.1fms, %d calls queued" %
+                    (elapsed * 1000, len(queue)))
+
+        if queue:
+            return True
+        self._source = None
+        return False
+
+
+scheduler = IdleScheduler()
@@ -0,0 +1,80 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""A clock for tests of code that uses time.time and GLib timeouts."""
+
+__all__ = ['FakeClock']
+
+
+class FakeClock(object):
+    """Stands in for both the time and the gobject module of the module
+    under test. time() returns the fake time, and timeouts run when
+    advance() moves the time past them."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self._timers = {}
+        self._next_source = 0
+        self._patched = []
+
+    def install(self, module):
+        """Replace time and gobject in module until uninstall()."""
+        self._patched.append((module, module.time, module.gobject))
+        module.time = self
+        module.gobject = self
+
+    def uninstall(self):
+        for module, time, gobject in self._patched:
+            module.time = time
+            module.gobject = gobject
+        self._patched = []
+
+    def time(self):
+        return self.now
+
+    def timeout_add(self, interval, func, *args):
+        self._next_source += 1
+        self._timers[self._next_source] = (self.now + interval / 1000.0,
+                interval, func, args)
+        return self._next_source
+
+    def source_remove(self, source):
+        del self._timers[source]
+
+    def pending(self):
+        return len(self._timers)
+
+    def advance(self, seconds):
+        """Move the time on, running the timeouts that fall due in order."""
+        end = self.now + seconds
+        while True:
+            due = [(entry[0], source) for source, entry in self._timers.items()
+                    if entry[0] <= end]
+            if not due:
+                break
+            when, source = min(due)
+            self.now = max(self.now, when)
+            when, interval, func, args = self._timers[source]
+            again = func(*args)
+            if source in self._timers:
+                if again:
+                    self._timers[source] = (self.now + interval / 1000.0,
+                            interval, func, args)
+                else:
+                    del self._timers[source]
+        self.now = end
@@ -0,0 +1,211 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Tests of mixer.outbox.
+
+    python -m unittest discover tests
+"""
+
+import logging
+import unittest
+
+from mixer import outbox
+from mixer.outbox import MessageQueue, QueueFull
+
+from clock import FakeClock
+
+
+class Buddy(object):
+    def __init__(self, jid):
+        self.jid = jid
+
+
+class Ack(object):
+    """What PyMXit passes to message_sent and message_error."""
+    def __init__(self, buddy, message):
+        self.buddy = buddy
+        self.message = message
+
+
+class Limiter(object):
+    """Holds submitted calls until run() is called."""
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, key, func, *args):
+        self.calls.append((key, func, args))
+
+    def keys(self):
+        return [key for key, func, args in self.calls]
+
+    def run(self):
+        calls = self.calls
+        self.calls = []
+        for key, func, args in calls:
+            func(*args)
+
+
+class MessageQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.install(outbox)
+        self.limiter = Limiter()
+        self.sent = []
+        self.expired = []
+        self.fail_transmit = False
+        self.bob = Buddy('bob')
+        self.ann = Buddy('ann')
+        self.joe = Buddy('joe')
+        logging.disable(logging.WARNING)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        self.clock.uninstall()
+
+    def queue(self, **kwargs):
+        return MessageQueue(self.transmit, self.limiter, self.expired.append,
+                **kwargs)
+
+    def transmit(self, buddy, text):
+        if self.fail_transmit:
+            raise IOError("not connected")
+        self.sent.append((buddy.jid, text))
+
+    def test_window(self):
+        queue = self.queue(window=2)
+        queue.submit(self.bob, 'a')
+        queue.submit(self.ann, 'b')
+        queue.submit(self.joe, 'c')
+        self.assertEqual(self.limiter.keys(), ['bob', 'ann'])
+        self.limiter.run()
+        self.assertEqual(queue.in_flight(), 2)
+        self.assertEqual(queue.queued(), 1)
+        self.assertEqual(self.limiter.keys(), [])
+
+        self.assertEqual(queue.acked(Ack(self.bob, 'a')).text, 'a')
+        self.assertEqual(self.limiter.keys(), ['joe'])
+
+    def test_one_message_per_recipient_in_the_limiter(self):
+        queue = self.queue()
+        for text in ['a', 'b', 'c']:
+            queue.submit(self.bob, text)
+        queue.submit(self.ann, 'd')
+        self.assertEqual(self.limiter.keys(), ['bob', 'ann'])
+        # once sent, the next message to the recipient takes the slot
+        self.limiter.run()
+        self.assertEqual(self.sent, [('bob', 'a'), ('ann', 'd')])
+        self.assertEqual(self.limiter.keys(), ['bob'])
+        self.limiter.run()
+        self.limiter.run()
+        self.assertEqual([text for jid, text in self.sent], ['a', 'd', 'b', 'c'])
+        self.assertEqual(queue.in_flight(), 4)
+
+    def test_max_queue(self):
+        queue = self.queue(window=1, max_queue=2)
+        queue.submit(self.bob, 'a')
+        queue.submit(self.ann, 'b')
+        queue.submit(self.joe, 'c')
+        self.assertRaises(QueueFull, queue.submit, self.joe, 'd')
+
+    def test_ack_matches_text(self):
+        queue = self.queue()
+        queue.submit(self.bob, 'a')
+        queue.submit(self.bob, 'b')
+        self.limiter.run()
+        self.limiter.run()
+        second = queue.acked(Ack(self.bob, 'b'))
+        self.assertEqual(second.text, 'b')
+        self.assertEqual(queue.in_flight(), 1)
+
+    def test_same_text_completes_oldest(self):
+        queue = self.queue()
+        first = queue.submit(self.bob, u'hi')
+        second = queue.submit(self.bob, u'hi')
+        self.limiter.run()
+        self.limiter.run()
+        self.assertEqual(queue.acked(Ack(self.bob, 'hi')).token, first)
+        self.assertEqual(queue.failed(Ack(self.bob, 'hi')).token, second)
+        self.assertEqual(queue.in_flight(), 0)
+
+    def test_unknown_ack(self):
+        queue = self.queue()
+        queue.submit(self.bob, 'a')
+        self.limiter.run()
+        self.assertEqual(queue.acked(Ack(self.bob, 'sent elsewhere')), None)
+        self.assertEqual(queue.failed(Ack(self.ann, 'a')), None)
+        self.assertEqual(queue.in_flight(), 1)
+        self.assertEqual(queue.stats()['delivered'], 0)
+
+    def test_hold_and_resume(self):
+        queue = self.queue()
+        queue.submit(self.bob, 'a')
+        self.limiter.run()
+        queue.submit(self.bob, 'b')
+        queue.submit(self.bob, 'c')
+        self.assertEqual(self.limiter.keys(), ['bob'])
+
+        lost = queue.hold()
+        self.assertEqual([message.text for message in lost], ['a'])
+        self.assertEqual(queue.in_flight(), 0)
+        self.assertEqual(queue.queued(), 2)
+        # the call still waiting in the limiter does nothing now
+        self.limiter.run()
+        self.assertEqual(self.sent, [('bob', 'a')])
+        queue.submit(self.bob, 'd')
+        self.assertEqual(self.limiter.keys(), [])
+
+        queue.resume()
+        for i in range(3):
+            self.limiter.run()
+        self.assertEqual([text for jid, text in self.sent], ['a', 'b', 'c', 'd'])
+
+    def test_expiry(self):
+        queue = self.queue(ack_timeout=10000)
+        queue.submit(self.bob, 'a')
+        self.limiter.run()
+        self.clock.advance(6)
+        queue.submit(self.bob, 'b')
+        self.limiter.run()
+        # checked every ack_timeout / 2
+        self.clock.advance(10)
+        self.assertEqual([message.text for message in self.expired], ['a'])
+        self.assertEqual(queue.in_flight(), 1)
+        self.clock.advance(10)
+        self.assertEqual([message.text for message in self.expired], ['a', 'b'])
+        self.assertEqual(queue.stats()['expired'], 2)
+        self.assertEqual(self.clock.pending(), 0)
+
+    def test_transmit_error(self):
+        queue = self.queue(window=1)
+        queue.submit(self.bob, 'a')
+        queue.submit(self.ann, 'b')
+        self.fail_transmit = True
+        self.limiter.run()
+        self.assertEqual([message.text for message in self.expired], ['a'])
+        self.assertEqual(queue.in_flight(), 1)
+        self.assertEqual(self.limiter.keys(), ['ann'])
+        self.fail_transmit = False
+        self.limiter.run()
+        self.assertEqual(self.sent, [('ann', 'b')])
+        self.assertEqual(queue.stats()['failed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+# telepathy-mixer - a MXit connection manager for Telepathy
+#
+# Copyright (C) 2008 Ralf Kistner <ralf.kistner@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Tests of mixer.util.ratelimit.
+
+    python -m unittest discover tests
+"""
+
+import logging
+import unittest
+
+from mixer.util import ratelimit
+from mixer.util.ratelimit import TokenBucket, RateLimiter, RateLimitExceeded, \
+        OVERFLOW_REJECT, OVERFLOW_COALESCE, OVERFLOW_DROP_OLDEST
+
+from clock import FakeClock
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.install(ratelimit)
+        self.calls = []
+
+    def tearDown(self):
+        self.clock.uninstall()
+
+    def call(self, value):
+        self.calls.append(value)
+
+    def test_burst(self):
+        bucket = TokenBucket(10, burst=3)
+        self.assertEqual([bucket.submit(self.call, i) for i in range(4)],
+                [True, True, True, False])
+        self.assertEqual(self.calls, [0, 1, 2])
+        self.assertEqual(bucket.pending(), 1)
+
+    def test_refill(self):
+        bucket = TokenBucket(10, burst=2)
+        for i in range(4):
+            bucket.submit(self.call, i)
+        self.assertEqual(self.calls, [0, 1])
+        self.clock.advance(0.1)
+        self.assertEqual(self.calls, [0, 1, 2])
+        self.clock.advance(0.1)
+        self.assertEqual(self.calls, [0, 1, 2, 3])
+        self.assertEqual(self.clock.pending(), 0)
+
+        # the bucket fills up to burst and no further
+        self.clock.advance(10)
+        self.assertTrue(bucket.idle())
+        self.assertEqual([bucket.submit(self.call, i) for i in range(3)],
+                [True, True, False])
+
+    def test_queued_calls_keep_their_order(self):
+        bucket = TokenBucket(10, burst=1)
+        for i in range(5):
+            bucket.submit(self.call, i)
+        self.clock.advance(1)
+        self.assertEqual(self.calls, range(5))
+
+    def test_overflow_reject(self):
+        bucket = TokenBucket(10, burst=1, max_queue=1, overflow=OVERFLOW_REJECT)
+        bucket.submit(self.call, 0)
+        bucket.submit(self.call, 1)
+        self.assertRaises(RateLimitExceeded, bucket.submit, self.call, 2)
+        self.assertEqual(bucket.rejected, 1)
+        self.clock.advance(1)
+        self.assertEqual(self.calls, [0, 1])
+
+    def test_overflow_coalesce(self):
+        bucket = TokenBucket(10, burst=1, max_queue=1, overflow=OVERFLOW_COALESCE)
+        def other(value):
+            self.fail("dropped call made")
+        bucket.submit(self.call, 0)
+        bucket.submit(self.call, 1)
+        bucket.submit(self.call, 2)
+        # the queue is full, and other has nothing to merge with
+        self.assertFalse(bucket.submit(other, 'x'))
+        self.assertEqual((bucket.coalesced, bucket.dropped), (1, 1))
+        self.clock.advance(1)
+        self.assertEqual(self.calls, [0, 2])
+
+    def test_overflow_drop_oldest(self):
+        bucket = TokenBucket(10, burst=1, max_queue=2, overflow=OVERFLOW_DROP_OLDEST)
+        for i in range(4):
+            bucket.submit(self.call, i)
+        self.assertEqual(bucket.dropped, 1)
+        self.clock.advance(1)
+        self.assertEqual(self.calls, [0, 2, 3])
+
+    def test_failing_call_does_not_stop_the_bucket(self):
+        bucket = TokenBucket(10, burst=1)
+        def fail():
+            raise ValueError("failed")
+        bucket.submit(self.call, 0)
+        bucket.submit(fail)
+        bucket.submit(self.call, 1)
+        logging.disable(logging.ERROR)
+        try:
+            self.clock.advance(1)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(self.calls, [0, 1])
+        self.assertEqual(bucket.pending(), 0)
+        self.assertEqual(bucket.calls, 3)
+
+    def test_cancel(self):
+        bucket = TokenBucket(10, burst=1)
+        bucket.submit(self.call, 0)
+        bucket.submit(self.call, 1)
+        bucket.cancel()
+        self.clock.advance(1)
+        self.assertEqual(self.calls, [0])
+        self.assertEqual(self.clock.pending(), 0)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.install(ratelimit)
+        self.calls = []
+
+    def tearDown(self):
+        self.clock.uninstall()
+
+    def test_buckets_per_key(self):
+        limiter = RateLimiter(10, burst=1)
+        self.assertTrue(limiter.submit('a', self.calls.append, 'a0'))
+        self.assertTrue(limiter.submit('b', self.calls.append, 'b0'))
+        self.assertFalse(limiter.submit('a', self.calls.append, 'a1'))
+        self.assertEqual(limiter.pending('a'), 1)
+        self.assertEqual(limiter.pending('b'), 0)
+        self.clock.advance(1)
+        self.assertEqual(self.calls, ['a0', 'b0', 'a1'])
+
+    def test_idle_buckets_are_pruned(self):
+        limiter = RateLimiter(10, burst=1, max_buckets=2)
+        limiter.submit('a', self.calls.append, 'a')
+        limiter.submit('b', self.calls.append, 'b')
+        self.clock.advance(1)
+        limiter.submit('c', self.calls.append, 'c')
+        self.assertEqual(limiter.stats()['buckets'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()